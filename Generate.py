@@ -1,75 +1,224 @@
 import geopandas
+import numpy as np
 import pandas as pd
 import shapely
 
-from source import Geometric
+from source import Cache, Geometric, PointCloudStore
 
 import argparse
 import csv
+import functools
+import io
+import multiprocessing
 import os
 from os import path
+from typing import Optional
+
+# query point clouds parsed from CSVs as PointCloudStore.DTYPE arrays by
+# perceptionId, kept across polygons and runs
+POINT_CLOUDS: Cache[str, np.ndarray] = Cache(0)
+# stores by directory, for --pc-dir given as a PointCloudStore
+STORES: dict[str, PointCloudStore] = dict()
+
+def readPointCloud(
+    pcDir: str,
+    perceptionId: str,
+    multiPolygon: shapely.MultiPolygon
+) -> np.ndarray:
+    # points of perceptionId, or for a store only those in tiles that
+    # intersect multiPolygon, which is in the same source coordinates
+    if PointCloudStore.isStore(pcDir):
+        if not pcDir in STORES:
+            STORES[pcDir] = PointCloudStore(pcDir)
+        return STORES[pcDir].readIntersecting(perceptionId, multiPolygon)
+    pointCloud: Optional[np.ndarray] = POINT_CLOUDS.get(perceptionId)
+    if pointCloud is None:
+        pointCloud = PointCloudStore.readCsv(
+            path.join(pcDir, f"{perceptionId}.csv"))
+        POINT_CLOUDS.put(perceptionId, pointCloud)
+    return pointCloud
+
+def transformClip(
+    pointCloud: np.ndarray,
+    multiPolygon: shapely.MultiPolygon,
+    translation: tuple[float, float],
+    destination: tuple[float, float],
+    rotation: float
+) -> list[tuple[float, float, float, int]]:
+    # points translated then rotated about destination, as is multiPolygon,
+    # and kept if they intersect it
+    matrix: np.ndarray = Geometric.composeMatrices(
+        Geometric.translationMatrix(translation),
+        Geometric.rotationMatrix(destination, rotation))
+    coords: np.ndarray = Geometric.affineArray(
+        np.stack((pointCloud["x"], pointCloud["y"]), axis=1), matrix)
+    clip: shapely.Geometry = Geometric.affineTransform(multiPolygon, matrix)
+    shapely.prepare(clip)
+    inside: np.ndarray = shapely.intersects_xy(
+        clip, coords[:, 0], coords[:, 1])
+    return list(zip(
+        coords[inside, 0].tolist(),
+        coords[inside, 1].tolist(),
+        pointCloud["z"][inside].tolist(),
+        pointCloud["label"][inside].tolist()))
+
+def readJobs(genDir: str, run: str) -> list[tuple[
+    str,
+    str,
+    shapely.MultiPolygon,
+    tuple[float, float],
+    tuple[float, float],
+    float
+]]:
+    # (run, perceptionId, multiPolygon, translation, destination, rotation)
+    # for each generated polygon of run
+    transformationDf: pd.DataFrame
+    with open(path.join(genDir, run, "perceptions.csv"), 'r') as fp:
+        transformationDf = pd.read_csv(
+            fp, header=0, index_col=0).rename(index=(lambda i: str(i)))
+    multiPolygonGdf: geopandas.GeoDataFrame
+    with open(path.join(genDir, run, "polygons.geojson"), 'r') as fp:
+        multiPolygonGdf = geopandas.read_file(fp)
+        multiPolygonGdf = multiPolygonGdf.set_index(
+            "id", drop=True).rename(index=(lambda i: str(i)))
+    jobs: list[tuple[
+        str,
+        str,
+        shapely.MultiPolygon,
+        tuple[float, float],
+        tuple[float, float],
+        float
+    ]] = list()
+    index: str
+    multiPolygon: geopandas.GeoSeries
+    for index, multiPolygon in multiPolygonGdf.iterrows():
+        perceptionId: str = transformationDf.loc[index]["perceptionId"]
+        translation: tuple[float, float] = tuple(
+            transformationDf.loc[index][["translationX", "translationY"]])
+        destination: tuple[float, float] = tuple(
+            transformationDf.loc[index][["destinationX", "destinationY"]])
+        rotation: float = transformationDf.loc[index]["rotationCCW"]
+        jobs.append((
+            run,
+            perceptionId,
+            multiPolygon["geometry"],
+            translation,
+            destination,
+            rotation
+        ))
+    return jobs
+
+def runJobs(
+    genDir: str,
+    pcDir: str,
+    jobs: list[tuple[
+        str,
+        str,
+        shapely.MultiPolygon,
+        tuple[float, float],
+        tuple[float, float],
+        float
+    ]],
+    lock: bool = False
+) -> int:
+    numPoints: int = 0
+    run: str
+    perceptionId: str
+    multiPolygon: shapely.MultiPolygon
+    translation: tuple[float, float]
+    destination: tuple[float, float]
+    rotation: float
+    for (
+        run,
+        perceptionId,
+        multiPolygon,
+        translation,
+        destination,
+        rotation
+    ) in jobs:
+        rows: list[tuple[float, float, float, int]] = transformClip(
+            readPointCloud(pcDir, perceptionId, multiPolygon),
+            multiPolygon,
+            translation,
+            destination,
+            rotation
+        )
+        print(len(rows), multiPolygon.__repr__())
+        appendRows(path.join(genDir, run, "points.csv"), rows, lock)
+        numPoints += len(rows)
+    return numPoints
+
+def appendRows(
+    filePath: str,
+    rows: list[tuple[float, float, float, int]],
+    lock: bool = False
+) -> None:
+    # one write per call, under an exclusive lock if lock, so processes
+    # appending to the same run do not interleave rows
+    buffer: io.StringIO = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    with open(filePath, 'a') as fp:
+        if not lock:
+            fp.write(buffer.getvalue())
+            return
+        # only available on Unix, so imported only for --workers
+        import fcntl
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            fp.write(buffer.getvalue())
+            fp.flush()
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+def initCache(cacheSize: int) -> None:
+    global POINT_CLOUDS
+    POINT_CLOUDS = Cache(cacheSize)
 
 def main(args: argparse.Namespace) -> None:
+    initCache(args.cache_size)
     dirpath: str
     runs: list[str]
     filenames: list[str]
     for dirpath, runs, filenames in os.walk(args.gen_dir):
         break
     run: str
+    if args.workers <= 1:
+        for run in runs:
+            runJobs(args.gen_dir, args.pc_dir, readJobs(args.gen_dir, run))
+        return
+    # jobs of every run grouped by perceptionId, so that each point cloud
+    # is read once by one worker
+    groups: dict[str, list[tuple[
+        str,
+        str,
+        shapely.MultiPolygon,
+        tuple[float, float],
+        tuple[float, float],
+        float
+    ]]] = dict()
     for run in runs:
-        transformationDf: pd.DataFrame
-        with open(
-            path.join(args.gen_dir, run, "perceptions.csv"), 'r') as fp:
-            transformationDf = pd.read_csv(
-                fp, header=0, index_col=0).rename(index=(lambda i: str(i)))
-        multiPolygonGdf: geopandas.GeoDataFrame
-        with open(
-            path.join(args.gen_dir, run, "polygons.geojson"), 'r') as fp:
-            multiPolygonGdf = geopandas.read_file(fp)
-            multiPolygonGdf = multiPolygonGdf.set_index(
-                "id", drop=True).rename(index=(lambda i: str(i)))
-        index: str
-        multiPolygon: geopandas.GeoSeries
-        for index, multiPolygon in multiPolygonGdf.iterrows():
-            perceptionId: str = transformationDf.loc[index]["perceptionId"]
-            translation: tuple[float, float] = tuple(
-                transformationDf.loc[index][["translationX", "translationY"]])
-            destination: tuple[float, float] = tuple(
-                transformationDf.loc[index][["destinationX", "destinationY"]])
-            rotation: float = transformationDf.loc[index]["rotationCCW"]
-            multiPolygon: shapely.MultiPolygon = multiPolygon["geometry"]
-            points: list[shapely.Point] = list()
-            labels: list[shapely.Point] = list()
-            with open(
-                path.join(args.pc_dir, f"{perceptionId}.csv"), 'r') as fp:
-                csvreader = csv.reader(fp)
-                for row in csvreader:
-                    pointxy = Geometric.rotateTuple(
-                        Geometric.translateTuple(
-                            (float(row[0]), float(row[1])), translation),
-                        destination,
-                        rotation
-                    )
-                    points.append(shapely.Point(pointxy[0], pointxy[1], row[2]))
-                    labels.append(int(row[3]))
-            pointsGdf: geopandas.GeoDataFrame = geopandas.GeoDataFrame(
-                data={"label": labels}, geometry=points).clip(
-                    Geometric.rotateAboutTuple(
-                        Geometric.translateVectorTuple(
-                            multiPolygon, translation),
-                        destination,
-                        rotation
-                    ), keep_geom_type=True)
-            print(len(pointsGdf), multiPolygon.__repr__())
-            rows: list[tuple[float, float, float, int]] = list()
-            pointLabel: geopandas.GeoSeries
-            for _, pointLabel in pointsGdf.iterrows():
-                point: shapely.Point = pointLabel["geometry"]
-                label: int = pointLabel["label"]
-                rows.append((point.x, point.y, point.z, label))
-            with open(path.join(args.gen_dir, run, "points.csv"), 'a') as fp:
-                csvwriter = csv.writer(fp)
-                csvwriter.writerows(rows)
+        job: tuple[
+            str,
+            str,
+            shapely.MultiPolygon,
+            tuple[float, float],
+            tuple[float, float],
+            float
+        ]
+        for job in readJobs(args.gen_dir, run):
+            groups.setdefault(job[1], list()).append(job)
+    print(
+        f"{sum(len(jobs) for jobs in groups.values())} polygons from "
+        f"{len(runs)} runs over {len(groups)} point clouds")
+    # workers set up their own cache, as they may not be forked
+    with multiprocessing.Pool(
+        args.workers, initializer=initCache, initargs=(args.cache_size,)
+    ) as pool:
+        numPoints: int = sum(pool.imap_unordered(
+            functools.partial(
+                runJobs, args.gen_dir, args.pc_dir, lock=True),
+            sorted(groups.values(), key=len, reverse=True)))
+    print(f"{numPoints} points generated")
 
 if __name__ == "__main__":
     parser: argparse.ArgumentParser = argparse.ArgumentParser()
@@ -90,6 +239,20 @@ if __name__ == "__main__":
             "    z: float\n"
             "label: int\n"
             "CSVs must have filenames corresponding to values in "
-            "perceptionId column in query point cloud transformation CSV."))
+            "perceptionId column in query point cloud transformation CSV.\n"
+            "Alternatively, a store imported from such a directory with "
+            "ImportPointClouds.py, which is memory-mapped instead of parsed."))
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help=(
+            "Number of processes to generate points with.\n"
+            "If more than 1, polygons of all runs are grouped by perceptionId "
+            "so that each point cloud is read once, and points.csv rows are "
+            "appended in the order groups finish."))
+    parser.add_argument(
+        "--cache-size", type=int, default=8,
+        help=(
+            "Number of parsed query point cloud CSVs to keep in memory "
+            "for reuse across polygons and runs."))
     args: argparse.Namespace = parser.parse_args()
     main(args)
\ No newline at end of file
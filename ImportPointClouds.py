@@ -0,0 +1,37 @@
+from source import PointCloudStore
+
+import argparse
+
+def main(args: argparse.Namespace) -> None:
+    store: PointCloudStore = PointCloudStore.importCsvs(
+        args.pc_dir, args.store_dir, args.tile_size)
+    print(f"Wrote {store}")
+
+if __name__ == "__main__":
+    parser: argparse.ArgumentParser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--pc-dir", type=str, required=True,
+        help = (
+            "Directory containing query point cloud CSVs "
+            "with no header and 4 columns:\n"
+            "    x: float\n"
+            "    y: float\n"
+            "    z: float\n"
+            "label: int\n"
+            "CSVs must have filenames corresponding to perception ids."))
+    parser.add_argument(
+        "--store-dir", type=str, required=True,
+        help=(
+            "Directory to write the point cloud store to, as one .npy array "
+            "per perception and a manifest.json.\n"
+            "Pass it as --pc-dir to Generate.py."))
+    parser.add_argument(
+        "--tile-size", type=float, default=25,
+        help=(
+            "Side in metres of the square tiles each point cloud is sorted "
+            "into.\n"
+            "Generate.py reads only the tiles intersecting each generated "
+            "polygon.\n"
+            "0 stores each point cloud as a single tile."))
+    args: argparse.Namespace = parser.parse_args()
+    main(args)
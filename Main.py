@@ -1,10 +1,34 @@
 import shapely
 
-from source import Attributes, Buildings, Collection, IO, Perception, Simulator
+from source import (
+    Attributes, Buildings, Collection, IO, Perception, Simulator, Transport)
 
 import argparse
+import functools
+import multiprocessing
+from typing import Optional
+
+# shared with workers forked by main, which inherit them without pickling
+SIMULATOR: Optional[Simulator] = None
+SITE_COLLECTION: Optional[Collection] = None
+
+def runSite(out: str, site: tuple[str, shapely.Polygon, Attributes]) -> str:
+    assert SIMULATOR is not None and SITE_COLLECTION is not None
+    id: str
+    sitePolygon: shapely.Polygon
+    siteAttributes: Attributes
+    id, sitePolygon, siteAttributes = site
+    IO.write(
+        out, id, SIMULATOR.run(sitePolygon, siteAttributes, SITE_COLLECTION))
+    return id
 
 def main(args: argparse.Namespace) -> None:
+    Perception.TRANSPORT = Transport(args.transport, args.transport_tolerance)
+    Collection.NUM_INDEXED_CANDIDATES = args.candidates
+    IO.CACHE_PREPARED = not args.no_cache
+    Buildings.RASTER_RESOLUTION = args.raster_resolution
+    Collection.NUM_THREADS = args.threads
+    Simulator.NUM_THREADS = args.generator_threads
     queryCollection: Collection = IO.initCollection(
         args.query[0], args.query[1], args.query[2])
     siteCollection: Collection = IO.initCollection(
@@ -16,6 +40,19 @@ def main(args: argparse.Namespace) -> None:
     siteCollection = siteCollection.filter(
         [polygon for id, polygon, attributes in sitePolygons])
     simulator: Simulator = Simulator(queryCollection, queryBuildings)
+    if args.workers > 1 and len(sitePolygons) > 1:
+        global SIMULATOR, SITE_COLLECTION
+        simulator.prepare()
+        SIMULATOR = simulator
+        SITE_COLLECTION = siteCollection
+        with multiprocessing.get_context("fork").Pool(
+            min(args.workers, len(sitePolygons)), maxtasksperchild=1
+        ) as pool:
+            siteId: str
+            for siteId in pool.imap_unordered(
+                functools.partial(runSite, args.out), sitePolygons):
+                print(f"Wrote generation for {siteId}")
+        return
     generations: list[tuple[str, list[tuple[
         Perception,
         shapely.Point,
@@ -86,5 +123,67 @@ if __name__ == "__main__":
     parser.add_argument(
         "-o", "--out", type=str, default="out",
         help="Output directory")
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help=(
+            "Do not read or write prepared collections cached as "
+            "<points GeoJSON>.prepared.npz next to the inputs."))
+    parser.add_argument(
+        "--candidates", type=int,
+        default=Collection.NUM_INDEXED_CANDIDATES,
+        help=(
+            "Number of query perceptions nearest by rotation-invariant "
+            "descriptor to evaluate for each site perception.\n"
+            "0 evaluates every query perception with the same cluster."))
+    parser.add_argument(
+        "--transport", type=str, default="exact", choices=Transport.MODES,
+        help=(
+            "Optimal transport engine for perception distances:\n"
+            "(1) exact: assignment for equal-sized point sets, "
+            "linear programme otherwise\n"
+            "(2) sliced: sliced Wasserstein distance, a lower bound on exact "
+            "with no control of how far below\n"
+            "(3) sinkhorn: entropic Sinkhorn upper bound"))
+    parser.add_argument(
+        "--transport-tolerance", type=float, default=1,
+        help=(
+            "Error tolerance in metres for approximate transport engines.\n"
+            "For sliced, this bounds only the error from the finite number "
+            "of projections, not the gap to exact, which is uncontrolled.\n"
+            "For sinkhorn, this bounds the error from entropic "
+            "regularisation and early stopping, falling back to exact if "
+            "it does not converge."))
+    parser.add_argument(
+        "--raster-resolution", type=float,
+        default=Buildings.RASTER_RESOLUTION,
+        help=(
+            "Grid resolution in metres for approximate building attributes "
+            "used to rank candidates before exact queries.\n"
+            "Finer grids have smaller error bounds but take longer to build.\n"
+            "0 queries every candidate exactly."))
+    parser.add_argument(
+        "--threads", type=int, default=Collection.NUM_THREADS,
+        help=(
+            "Number of threads to evaluate candidate perceptions for each "
+            "query.\n"
+            "Results are identical to evaluating them in a single thread."))
+    parser.add_argument(
+        "--generator-threads", type=int, default=Simulator.NUM_THREADS,
+        help=(
+            "Number of threads to query the generators of each polygon "
+            "concurrently.\n"
+            "Results are merged in generator order, so they are identical "
+            "to querying them one after another."))
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help=(
+            "Number of processes to generate site polygons in parallel.\n"
+            "Each writes the output of a site polygon once it is generated.\n"
+            "Requires the fork start method."))
     args: argparse.Namespace = parser.parse_args()
+    if (
+        args.workers > 1
+        and not "fork" in multiprocessing.get_all_start_methods()
+    ):
+        parser.error("--workers requires the fork start method")
     main(args)
\ No newline at end of file
@@ -106,6 +106,18 @@ class Attributes:
                 other.footprintArea - self.footprintArea)
         ])
 
+    def distanceError(self, error: Self) -> float:
+        # bound on the change in distanceTo(other) when the GFA and
+        # footprint of other are each off by at most those of error; the
+        # height of other must not be overestimated, as it is not bounded
+        return sum([
+            self.RESIDENTIAL_WEIGHT * error.residentialGfa,
+            self.COMMERCIAL_WEIGHT * error.commercialGfa,
+            self.CIVIC_WEIGHT * error.civicGfa,
+            self.OTHER_WEIGHT * error.otherGfa,
+            self.FOOTPRINT_WEIGHT * error.footprintArea
+        ])
+
     def toCsvRow(self) -> tuple:
         return (
             self.height,
@@ -1,78 +1,447 @@
 import geopandas # type: ignore[import-untyped]
+import numpy as np
 import pandas as pd
 import shapely
 
 from .Attributes import Attributes
 
-from typing import Self
+import math
+from typing import Callable, Optional, Self, Sequence
 
 class Buildings:
-    def __init__(self, polygons: geopandas.GeoDataFrame) -> None:
-        self.polygons: geopandas.GeoDataFrame = polygons
+    GFA_COLUMNS: tuple[str, ...] = (
+        "residential_gfa",
+        "commercial_gfa",
+        "civic_gfa",
+        "other_gfa"
+    )
+    # grid resolution in metres of the approximate engine, 0 to disable
+    RASTER_RESOLUTION: float = 0
+
+    def __init__(self,
+        polygons: Optional[geopandas.GeoDataFrame] = None,
+        materialise: Optional[Callable[[], geopandas.GeoDataFrame]] = None
+    ) -> None:
+        # query results are materialised from their source on first use
+        if polygons is None and materialise is None:
+            raise ValueError("Either polygons or materialise must be given!")
+        self.polygons: Optional[geopandas.GeoDataFrame] = polygons
+        self.materialise: Optional[
+            Callable[[], geopandas.GeoDataFrame]] = materialise
+        # built on first query, see initIndex
+        self.geometries: np.ndarray
+        self.valid: np.ndarray
+        self.areas: np.ndarray
+        self.heights: np.ndarray
+        self.gfas: np.ndarray
+        self.tree: shapely.STRtree
+        self.indexed: bool = False
+        # built on first approximate query, see initRaster
+        self.rasterOrigin: tuple[float, float]
+        self.rasterShape: tuple[int, int]
+        self.rasterSums: np.ndarray
+        self.rasterMaxima: np.ndarray
+        self.rasterHeights: np.ndarray
+        self.rasterized: bool = False
 
     @classmethod
     def empty(cls) -> Self:
         return cls(geopandas.GeoDataFrame())
 
+    def initIndex(self) -> None:
+        if self.indexed:
+            return
+        polygons: geopandas.GeoDataFrame = self.getPolygons()
+        self.geometries = polygons.geometry.to_numpy()
+        self.valid = shapely.is_valid(self.geometries)
+        self.areas = shapely.area(self.geometries)
+        self.heights = polygons["height"].to_numpy()
+        self.gfas = polygons[list(self.GFA_COLUMNS)].to_numpy(
+            dtype=np.float64)
+        self.tree = shapely.STRtree(self.geometries)
+        self.indexed = True
+
+    def initRaster(self) -> None:
+        if self.rasterized:
+            return
+        self.initIndex()
+        resolution: float = self.RASTER_RESOLUTION
+        if resolution <= 0:
+            raise ValueError(
+                f"Raster resolution {resolution} must be positive!")
+        print(f"Rasterising buildings at {resolution} m...")
+        minX: float
+        minY: float
+        maxX: float
+        maxY: float
+        minX, minY, maxX, maxY = shapely.total_bounds(self.geometries)
+        nx: int = max(math.ceil((maxX - minX) / resolution), 1)
+        ny: int = max(math.ceil((maxY - minY) / resolution), 1)
+        # footprint area and GFA per use, exactly apportioned to cells by
+        # the area of each building within them
+        values: np.ndarray = np.zeros((1 + len(self.GFA_COLUMNS), ny, nx))
+        heights: np.ndarray = np.full((ny, nx), -np.inf)
+        geometries: np.ndarray = shapely.make_valid(self.geometries)
+        i: int
+        for i in np.flatnonzero(self.areas > 0):
+            bounds: np.ndarray = shapely.bounds(geometries[i])
+            c0: int = min(int((bounds[0] - minX) // resolution), nx - 1)
+            r0: int = min(int((bounds[1] - minY) // resolution), ny - 1)
+            c1: int = min(
+                max(math.ceil((bounds[2] - minX) / resolution), c0 + 1), nx)
+            r1: int = min(
+                max(math.ceil((bounds[3] - minY) / resolution), r0 + 1), ny)
+            cols: np.ndarray
+            rows: np.ndarray
+            cols, rows = np.meshgrid(np.arange(c0, c1), np.arange(r0, r1))
+            boxes: np.ndarray = shapely.box(
+                minX + cols * resolution,
+                minY + rows * resolution,
+                minX + (cols + 1) * resolution,
+                minY + (rows + 1) * resolution)
+            shapely.prepare(geometries[i])
+            inside: np.ndarray = shapely.contains(geometries[i], boxes)
+            crossed: np.ndarray = ~inside & shapely.intersects(
+                geometries[i], boxes)
+            areas: np.ndarray = np.where(inside, resolution ** 2, 0.0)
+            areas[crossed] = shapely.area(
+                shapely.intersection(boxes[crossed], geometries[i]))
+            values[0, r0:r1, c0:c1] += areas
+            values[1:, r0:r1, c0:c1] += (
+                np.nan_to_num(self.gfas[i])[:, None, None]
+                * areas / self.areas[i])
+            # only valid buildings count in queryMany heights once they
+            # intersect a region, so only they count in cell heights
+            if self.valid[i]:
+                heights[r0:r1, c0:c1] = np.where(
+                    areas > 0,
+                    np.fmax(heights[r0:r1, c0:c1], float(self.heights[i])),
+                    heights[r0:r1, c0:c1])
+        self.rasterOrigin = (minX, minY)
+        self.rasterShape = (ny, nx)
+        # prefix sums along rows, so a run of cells sums in O(1)
+        self.rasterSums = np.concatenate(
+            (np.zeros((len(values), ny, 1)), np.cumsum(values, axis=2)),
+            axis=2)
+        self.rasterMaxima = values.reshape(len(values), -1).max(axis=1)
+        self.rasterHeights = heights
+        self.rasterized = True
+
     def query(self, regions: list[shapely.Polygon]) -> tuple[Attributes, Self]:
-        region: shapely.MultiPolygon = shapely.MultiPolygon(regions)
-        within: geopandas.GeoDataFrame = self.polygons.iloc[
-            self.polygons.sindex.query(region, predicate="contains")]
-        intersects: geopandas.GeoDataFrame = self.polygons.iloc[
-            self.polygons.sindex.query(region, predicate="intersects")]
-        boundary: geopandas.GeoDataFrame = intersects.loc[
-            intersects.index.difference(within.index, sort=False)]
-        boundary = boundary[boundary.is_valid]
-        boundaryClippedGdf: geopandas.GeoDataFrame
-        try:
-            boundaryClippedGdf = boundary.clip(region, keep_geom_type=True)
-        except Exception as e:
-            boundaryClippedGdf = boundary[0:0]
-            print(e)
-        boundaryClippedGdf = boundaryClippedGdf[boundaryClippedGdf.is_valid]
-        boundary = boundary.join(boundaryClippedGdf, lsuffix="_full")
-        boundary["ratio"] = boundary["geometry"].area.div(
-            boundary["geometry_full"].area)
-        boundary[[
-            "residential_gfa",
-            "commercial_gfa",
-            "civic_gfa",
-            "other_gfa"
-        ]] = boundary[[
-            "residential_gfa",
-            "commercial_gfa",
-            "civic_gfa",
-            "other_gfa"
-        ]].mul(boundary["ratio"], axis=0)
-        queriedGdf: geopandas.GeoDataFrame = pd.concat((
-            within[[
-                "height",
-                "residential_gfa",
-                "commercial_gfa",
-                "civic_gfa",
-                "other_gfa",
-                "geometry"
-            ]],
-            boundary[[
-                "height",
-                "residential_gfa",
-                "commercial_gfa",
-                "civic_gfa",
-                "other_gfa",
-                "geometry"
-            ]]
-        ), axis=0)
-        
-        attributes: Attributes = Attributes(
-            queriedGdf["height"].max(),
-            queriedGdf["residential_gfa"].sum(),
-            queriedGdf["commercial_gfa"].sum(),
-            queriedGdf["civic_gfa"].sum(),
-            queriedGdf["other_gfa"].sum(),
-            queriedGdf["geometry"].area.sum(),
-            sum([region.area for region in regions])
+        return self.queryMany([regions])[0]
+
+    def queryMany(self,
+        regionsList: Sequence[list[shapely.Polygon]]
+    ) -> list[tuple[Attributes, Self]]:
+        # same results as query on each list of regions, however they are
+        # batched: buildings within a region count in full, and valid
+        # buildings on its boundary count by the polygonal part of their
+        # intersection with it, if that does not fail
+        self.initIndex()
+        masks: np.ndarray = np.array([
+            shapely.MultiPolygon(regions)
+            for regions in regionsList], dtype=object)
+        pairs: np.ndarray = self.tree.query(masks, predicate="intersects")
+        pairs = pairs[:, np.lexsort((pairs[1], pairs[0]))]
+        within: np.ndarray = shapely.contains(
+            masks[pairs[0]], self.geometries[pairs[1]])
+        boundary: np.ndarray = ~within & self.valid[pairs[1]]
+        pairs = pairs[:, within | boundary]
+        within = within[within | boundary]
+        clipped: np.ndarray = np.full(pairs.shape[1], None, dtype=object)
+        clipped[~within] = Buildings.clipPolygons(
+            self.geometries[pairs[1, ~within]], masks[pairs[0, ~within]])
+        clippedAreas: np.ndarray = np.where(
+            within, self.areas[pairs[1]], shapely.area(clipped))
+        ratios: np.ndarray = np.where(
+            within, 1, clippedAreas / self.areas[pairs[1]])
+        gfas: np.ndarray = self.gfas[pairs[1]] * ratios[:, None]
+        offsets: np.ndarray = np.searchsorted(
+            pairs[0], np.arange(len(regionsList) + 1))
+        results: list[tuple[Attributes, Self]] = list()
+        i: int
+        regions: list[shapely.Polygon]
+        for i, regions in enumerate(regionsList):
+            start: int = offsets[i]
+            end: int = offsets[i + 1]
+            heights: np.ndarray = self.heights[pairs[1, start:end]]
+            heights = heights[~pd.isna(heights)]
+            gfa: np.ndarray = np.nansum(gfas[start:end], axis=0)
+            attributes: Attributes = Attributes(
+                heights.max() if len(heights) > 0 else np.nan,
+                gfa[0],
+                gfa[1],
+                gfa[2],
+                gfa[3],
+                np.nansum(clippedAreas[start:end]),
+                sum([region.area for region in regions])
+            )
+            results.append((attributes, Buildings(
+                materialise=self.materialiser(
+                    pairs[1, start:end],
+                    within[start:end],
+                    clipped[start:end],
+                    gfas[start:end])
+            ))) # type: ignore[arg-type]
+        return results
+
+    def approximateMany(self,
+        regionsList: Sequence[list[shapely.Polygon]]
+    ) -> list[tuple[Attributes, Attributes]]:
+        # estimates of queryMany attributes from cells with centres in the
+        # regions, each with a worst-case absolute error per attribute from
+        # the contents of cells crossed by region boundaries; heights are
+        # from cells wholly inside the regions, so never exceed queryMany
+        self.initRaster()
+        results: list[tuple[Attributes, Attributes]] = list()
+        regions: list[shapely.Polygon]
+        for regions in regionsList:
+            sums: np.ndarray = np.zeros(len(self.rasterSums))
+            errors: np.ndarray = np.zeros(len(self.rasterSums))
+            height: float = -np.inf
+            region: shapely.Polygon
+            for region in regions:
+                runs: tuple[np.ndarray, np.ndarray, np.ndarray] = (
+                    self.rasterRuns(region))
+                crossings: tuple[np.ndarray, np.ndarray, np.ndarray] = (
+                    self.rasterCrossings(region))
+                sums += (
+                    self.rasterSums[:, runs[0], runs[2]]
+                    - self.rasterSums[:, runs[0], runs[1]]).sum(axis=1)
+                errors += (
+                    self.rasterSums[:, crossings[0], crossings[2]]
+                    - self.rasterSums[:, crossings[0], crossings[1]]
+                ).sum(axis=1)
+                height = max(
+                    height, self.rasterInteriorMaximum(runs, crossings))
+            results.append((
+                Attributes(
+                    height if np.isfinite(height) else np.nan,
+                    sums[1],
+                    sums[2],
+                    sums[3],
+                    sums[4],
+                    sums[0],
+                    sum([region.area for region in regions])
+                ),
+                Attributes(
+                    0,
+                    errors[1],
+                    errors[2],
+                    errors[3],
+                    errors[4],
+                    errors[0],
+                    0
+                )
+            ))
+        return results
+
+    def rasterEdges(self, region: shapely.Polygon) -> np.ndarray:
+        # (n, 4) x0, y0, x1, y1 of the edges of all rings of region
+        coords: np.ndarray
+        rings: np.ndarray
+        coords, rings = shapely.get_coordinates(
+            shapely.get_rings(region), return_index=True)
+        sameRing: np.ndarray = rings[:-1] == rings[1:]
+        return np.concatenate(
+            (coords[:-1][sameRing], coords[1:][sameRing]), axis=1)
+
+    def rasterRuns(self,
+        region: shapely.Polygon
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # row, first column and end column of every run of cells in a row
+        # with centres in region, by even-odd crossings of row centre lines
+        resolution: float = self.RASTER_RESOLUTION
+        ny: int
+        nx: int
+        ny, nx = self.rasterShape
+        edges: np.ndarray = self.rasterEdges(region)
+        minX: float
+        minY: float
+        maxX: float
+        maxY: float
+        minX, minY, maxX, maxY = region.bounds
+        rows: np.ndarray = np.arange(
+            max(math.ceil((minY - self.rasterOrigin[1]) / resolution - 0.5), 0),
+            min(math.floor(
+                (maxY - self.rasterOrigin[1]) / resolution - 0.5) + 1, ny))
+        ys: np.ndarray = (
+            self.rasterOrigin[1] + (rows[:, None] + 0.5) * resolution)
+        crosses: np.ndarray = (edges[:, 1] <= ys) != (edges[:, 3] <= ys)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            xs: np.ndarray = np.where(
+                crosses,
+                edges[:, 0] + (ys - edges[:, 1])
+                * (edges[:, 2] - edges[:, 0]) / (edges[:, 3] - edges[:, 1]),
+                np.inf)
+        xs = np.sort(xs, axis=1)
+        if xs.shape[1] % 2 > 0:
+            xs = np.concatenate((xs, np.full((len(xs), 1), np.inf)), axis=1)
+        starts: np.ndarray = xs[:, 0::2]
+        ends: np.ndarray = xs[:, 1::2]
+        runs: np.ndarray = np.isfinite(ends)
+        c0: np.ndarray = np.clip(np.ceil(
+            (starts[runs] - self.rasterOrigin[0]) / resolution - 0.5), 0, nx)
+        c1: np.ndarray = np.clip(np.floor(
+            (ends[runs] - self.rasterOrigin[0]) / resolution - 0.5) + 1, 0, nx)
+        runRows: np.ndarray = np.broadcast_to(rows[:, None], runs.shape)[runs]
+        nonEmpty: np.ndarray = c1 > c0
+        return (
+            runRows[nonEmpty],
+            c0[nonEmpty].astype(np.int64),
+            c1[nonEmpty].astype(np.int64)
         )
-        return attributes, Buildings(queriedGdf) # type: ignore[return-value]
+
+    def rasterCrossings(self,
+        region: shapely.Polygon
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # row, first column and end column of the cells each edge of region
+        # crosses in each row, the only cells rasterRuns can misclassify
+        resolution: float = self.RASTER_RESOLUTION
+        ny: int
+        nx: int
+        ny, nx = self.rasterShape
+        edges: np.ndarray = self.rasterEdges(region)
+        minY: float = region.bounds[1]
+        maxY: float = region.bounds[3]
+        rows: np.ndarray = np.arange(
+            max(math.floor((minY - self.rasterOrigin[1]) / resolution), 0),
+            min(math.floor((maxY - self.rasterOrigin[1]) / resolution) + 1, ny))
+        lows: np.ndarray = (
+            self.rasterOrigin[1] + rows[:, None] * resolution)
+        edgeLows: np.ndarray = np.minimum(edges[:, 1], edges[:, 3])
+        edgeHighs: np.ndarray = np.maximum(edges[:, 1], edges[:, 3])
+        overlaps: np.ndarray = (
+            (edgeLows <= lows + resolution) & (edgeHighs >= lows))
+        ya: np.ndarray = np.clip(lows, edgeLows, edgeHighs)
+        yb: np.ndarray = np.clip(lows + resolution, edgeLows, edgeHighs)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slopes: np.ndarray = (
+                (edges[:, 2] - edges[:, 0]) / (edges[:, 3] - edges[:, 1]))
+            xa: np.ndarray = np.where(
+                np.isfinite(slopes),
+                edges[:, 0] + (ya - edges[:, 1]) * slopes,
+                edges[:, 0])
+            xb: np.ndarray = np.where(
+                np.isfinite(slopes),
+                edges[:, 0] + (yb - edges[:, 1]) * slopes,
+                edges[:, 2])
+        c0: np.ndarray = np.clip(np.floor(
+            (np.minimum(xa, xb)[overlaps] - self.rasterOrigin[0]) / resolution
+        ), 0, nx)
+        c1: np.ndarray = np.clip(np.floor(
+            (np.maximum(xa, xb)[overlaps] - self.rasterOrigin[0]) / resolution
+        ) + 1, 0, nx)
+        crossRows: np.ndarray = np.broadcast_to(
+            rows[:, None], overlaps.shape)[overlaps]
+        nonEmpty: np.ndarray = c1 > c0
+        return (
+            crossRows[nonEmpty],
+            c0[nonEmpty].astype(np.int64),
+            c1[nonEmpty].astype(np.int64)
+        )
+
+    def rasterInteriorMaximum(self,
+        runs: tuple[np.ndarray, np.ndarray, np.ndarray],
+        crossings: tuple[np.ndarray, np.ndarray, np.ndarray]
+    ) -> float:
+        # maximum height over cells of runs that no crossing covers, which
+        # lie wholly inside the region
+        rows: np.ndarray
+        c0: np.ndarray
+        c1: np.ndarray
+        rows, c0, c1 = runs
+        if len(rows) <= 0:
+            return -np.inf
+        r0: int = int(rows.min())
+        col0: int = int(c0.min())
+        shape: tuple[int, int] = (
+            int(rows.max()) - r0 + 1, int(c1.max()) - col0 + 1)
+        # runs add 1 and crossings subtract 1 over their columns, by
+        # differences along each row
+        counts: np.ndarray = np.zeros(shape, dtype=np.int64)
+        np.add.at(counts, (rows - r0, c0 - col0), 1)
+        np.add.at(counts, (rows - r0, c1 - col0), -1)
+        crossRows: np.ndarray
+        crossC0: np.ndarray
+        crossC1: np.ndarray
+        crossRows, crossC0, crossC1 = crossings
+        inWindow: np.ndarray = (
+            (crossRows >= r0) & (crossRows < r0 + shape[0]))
+        crossRows = crossRows[inWindow] - r0
+        crossC0 = np.clip(crossC0[inWindow] - col0, 0, shape[1] - 1)
+        crossC1 = np.clip(crossC1[inWindow] - col0, 0, shape[1] - 1)
+        np.add.at(counts, (crossRows, crossC0), -len(rows))
+        np.add.at(counts, (crossRows, crossC1), len(rows))
+        interior: np.ndarray = np.cumsum(counts, axis=1)[:, :-1] > 0
+        if not interior.any():
+            return -np.inf
+        return float(self.rasterHeights[
+            r0:r0 + shape[0], col0:col0 + shape[1] - 1][interior].max())
+
+    @staticmethod
+    def clipPolygons(
+        geometries: np.ndarray,
+        masks: np.ndarray
+    ) -> np.ndarray:
+        # polygonal part of each intersection, or None if there is none, as
+        # GeoDataFrame.clip with keep_geom_type; if an intersection fails,
+        # as for an invalid mask, only that pair is None
+        intersections: np.ndarray
+        i: int
+        try:
+            intersections = shapely.intersection(geometries, masks)
+        except Exception:
+            intersections = np.full(len(geometries), None, dtype=object)
+            for i in range(len(geometries)):
+                try:
+                    intersections[i] = shapely.intersection(
+                        geometries[i], masks[i])
+                except Exception as e:
+                    print(e)
+        clipped: np.ndarray = np.full(len(geometries), None, dtype=object)
+        typeIds: np.ndarray = shapely.get_type_id(intersections)
+        # polygons and multipolygons are kept whole if valid and non-empty
+        polygonal: np.ndarray = np.flatnonzero(
+            np.isin(typeIds, (3, 6))
+            & ~shapely.is_empty(intersections)
+            & shapely.is_valid(intersections))
+        clipped[polygonal] = intersections[polygonal]
+        # collections are exploded, keeping their valid polygons
+        for i in np.flatnonzero(typeIds == 7):
+            polygons: list[shapely.Polygon] = [
+                part
+                for part in shapely.get_parts(
+                    shapely.get_parts(intersections[i]))
+                if isinstance(part, shapely.Polygon)
+                and not part.is_empty and part.is_valid]
+            if len(polygons) > 0:
+                clipped[i] = shapely.MultiPolygon(polygons)
+        return clipped
+
+    def materialiser(self,
+        indices: np.ndarray,
+        within: np.ndarray,
+        clipped: np.ndarray,
+        gfas: np.ndarray
+    ) -> Callable[[], geopandas.GeoDataFrame]:
+        # buildings within the regions followed by clipped boundary buildings
+        def materialise() -> geopandas.GeoDataFrame:
+            order: np.ndarray = np.argsort(~within, kind="stable")
+            queried: geopandas.GeoDataFrame = self.getPolygons().iloc[
+                indices[order]][["height", *self.GFA_COLUMNS, "geometry"]]
+            queried = queried.copy()
+            queried[list(self.GFA_COLUMNS)] = gfas[order]
+            queried["geometry"] = np.where(
+                within, self.geometries[indices], clipped)[order]
+            return queried
+        return materialise
+
+    def getPolygons(self) -> geopandas.GeoDataFrame:
+        if self.polygons is None:
+            assert self.materialise is not None
+            self.polygons = self.materialise()
+        return self.polygons
 
     def getBuildings(self) -> geopandas.GeoDataFrame:
-        return self.polygons.copy()
\ No newline at end of file
+        return self.getPolygons().copy()
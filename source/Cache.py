@@ -0,0 +1,43 @@
+import collections
+from typing import Generic, Hashable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+class Cache(Generic[K, V]):
+    def __init__(self, maxSize: int) -> None:
+        if maxSize < 0:
+            raise ValueError(f"Cache size {maxSize} must not be negative!")
+        self.maxSize: int = maxSize
+        self.entries: collections.OrderedDict[K, V] = collections.OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"Cache: {len(self.entries)}/{self.maxSize} "
+            f"({self.hits} hits, {self.misses} misses)")
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: K) -> Optional[V]:
+        if not key in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key: K, value: V) -> None:
+        if self.maxSize <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
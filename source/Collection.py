@@ -1,21 +1,86 @@
-import geopandas # type: ignore[import-untyped]
+import numpy as np
+from scipy import spatial # type: ignore[import-untyped]
 import shapely
 import tqdm
 
 from .Attributes import Attributes
 from .Buildings import Buildings
+from .Cache import Cache
 from .Geometric import Geometric
 from .Perception import Perception
 from .Sample import Sample
+from .SampleTable import SampleTable
+from .SpatialIndex import SpatialIndex
 
-from typing import Collection as CollectionType, Self, Sequence
+import concurrent.futures
+import heapq
+import math
+import threading
+from typing import (
+    Callable, Collection as CollectionType, Optional, Self, Sequence, TypeVar,
+    Union)
+
+T = TypeVar("T")
+U = TypeVar("U")
 
 class Collection:
     PERCEPTION_RADIUS: float = 100
     NUM_CONSIDERED_PERCEPTIONS: int = 20
+    NUM_INDEXED_CANDIDATES: int = 200
+    DESCRIPTOR_BINS: int = 8
+    CACHE_SIZE: int = 1 << 16
+    BOUND_TOLERANCE: float = 1e-6
+    NUM_THREADS: int = 1
+    QUERY_BATCH_SIZE: int = 4
 
-    def __init__(self, perceptions: CollectionType[Perception]) -> None:
+    def __init__(self,
+        perceptions: CollectionType[Perception],
+        samples: Optional[Sequence[Sample]] = None,
+        sampleIndex: Optional[SpatialIndex] = None,
+        regionIndex: Optional[SpatialIndex] = None,
+        sampleTable: Optional[SampleTable] = None,
+        perceptionLookup: Optional[
+            dict[tuple[float, float, int], Perception]] = None
+    ) -> None:
         self.perceptions: tuple[Perception, ...] = tuple(perceptions)
+        # deduplicated samples of all perceptions, as objects and as a table
+        # with matching rows, and indices over their points and over
+        # perception regions, derived on first use if None
+        self.samples: Optional[tuple[Sample, ...]] = (
+            None if samples is None else tuple(samples))
+        self.sampleTable: Optional[SampleTable] = sampleTable
+        self.sampleIndex: Optional[SpatialIndex] = sampleIndex
+        self.regionIndex: Optional[SpatialIndex] = regionIndex
+        # first perception at each (x, y, cluster), see perceptionFromSample,
+        # built on first use if None
+        self.perceptionLookup: Optional[
+            dict[tuple[float, float, int], Perception]] = perceptionLookup
+        # rotations and distances to other perceptions, keyed on
+        # (kind, perception id, other fingerprint)
+        self.cache: Cache[tuple[str, str, bytes], float] = Cache(
+            self.CACHE_SIZE)
+        # guards the cache and counters between concurrent queries
+        self.lock: threading.Lock = threading.Lock()
+        # built on first rotation search, see initRotationIndex
+        self.rotationClusters: np.ndarray
+        self.rotationCounts: np.ndarray
+        self.rotationAngles: np.ndarray
+        self.rotationOwn: np.ndarray
+        self.clusterPerceptions: dict[int, np.ndarray]
+        self.rotationBlocks: dict[
+            tuple[int, int], tuple[np.ndarray, np.ndarray]]
+        self.rotationIndexed: bool = False
+        # built on first rotation search, see initDescriptorIndex
+        self.descriptorScale: np.ndarray
+        self.descriptorTrees: dict[int, spatial.cKDTree]
+        self.descriptorTree: spatial.cKDTree
+        self.descriptorIndexed: bool = False
+        # attributes of whole regions for the buildings last queried, see
+        # initRegionAttributes, and counts of candidates pruned by them
+        self.regionAttributes: dict[str, Attributes]
+        self.regionBuildings: Optional[Buildings] = None
+        self.prunedCandidates: int = 0
+        self.evaluatedCandidates: int = 0
 
     def __repr__(self) -> str:
         return f"Collection: {len(self.perceptions)}"
@@ -27,22 +92,33 @@ class Collection:
         print("Initialising collection...")
         if len(ids) != len(points) or len(ids) != len(regions):
             raise ValueError("Number of ids, points, and regions must match!")
-        samplesList: list[Sample] = list(samples)
-        samplesGdf: geopandas.GeoDataFrame = geopandas.GeoDataFrame(
-            data={"sample": samplesList},
-            geometry=[sample.getPoint() for sample in samplesList]
-        )
-        samplesGdf.sindex
+        sampleTable: SampleTable
+        sampleTable, _ = SampleTable.fromSamples(samples).unique()
+        samplesList: list[Sample] = sampleTable.toSamples()
+        sampleTree: shapely.STRtree = shapely.STRtree(
+            [sample.getPoint() for sample in samplesList])
+        # (region index, sample index) for every sample in every region
+        pairs: np.ndarray = sampleTree.query(
+            list(regions), predicate="intersects")
+        pairs = pairs[:, np.lexsort((pairs[1], pairs[0]))]
+        offsets: np.ndarray = np.searchsorted(
+            pairs[0], np.arange(len(regions) + 1))
         perceptions: list[Perception] = list()
         i: int
         for i in range(len(ids)):
-            region: shapely.Polygon = regions[i]
-            samplesInRegion: list[Sample] = samplesGdf.iloc[
-                samplesGdf.sindex.query(region, predicate="intersects")
-            ]["sample"].to_list()
-            perceptions.append(
-                Perception(ids[i], points[i], regions[i], samplesInRegion))
-        return cls(perceptions)
+            samplesInRegion: list[Sample] = [
+                samplesList[j] for j in pairs[1, offsets[i]:offsets[i + 1]]]
+            perceptions.append(Perception(
+                ids[i], points[i], regions[i], samplesInRegion, clip=False))
+        # samples outside every region belong to no perception
+        inRegions: np.ndarray = np.unique(pairs[1])
+        return cls(
+            perceptions,
+            [samplesList[j] for j in inRegions],
+            SpatialIndex(sampleTree.geometries[inRegions]),
+            SpatialIndex(regions),
+            sampleTable.take(inRegions)
+        )
 
     def query(self,
         query: Perception,
@@ -59,8 +135,88 @@ class Collection:
         print(f"Querying {self.__repr__()} with {query}")
         perceptionRotations: list[
             tuple[Perception, float]] = self.findRotations(query)
-        destination: tuple[float, float] = (
-            query.getPoint().x, query.getPoint().y)
+        print("Calculating attributes with found perceptions...")
+        lowerBounds: np.ndarray = self.attributesLowerBounds(
+            [perception for perception, _ in perceptionRotations],
+            queryBuildings,
+            target
+        )
+        # top candidates by attributes distance as a max-heap keyed on
+        # (-distance, -candidate index), so ties keep candidate order
+        heap: list[tuple[float, int, tuple[
+            float,
+            Perception,
+            float,
+            list[shapely.Polygon],
+            Attributes,
+            Buildings
+        ]]] = list()
+        threshold: float = math.inf
+        pruned: int = 0
+        order: np.ndarray = np.argsort(lowerBounds, kind="stable")
+        start: int
+        for start in tqdm.tqdm(range(
+            0, len(order), max(self.NUM_CONSIDERED_PERCEPTIONS, 1))):
+            chunk: list[int] = [
+                int(i)
+                for i in order[start:start + max(
+                    self.NUM_CONSIDERED_PERCEPTIONS, 1)]
+                if not lowerBounds[i] - self.BOUND_TOLERANCE > threshold]
+            pruned += min(
+                self.NUM_CONSIDERED_PERCEPTIONS, len(order) - start
+            ) - len(chunk)
+            if len(chunk) <= 0:
+                # candidates are in increasing order of lower bound
+                pruned += max(
+                    len(order) - start - self.NUM_CONSIDERED_PERCEPTIONS, 0)
+                break
+            evaluated: list[tuple[
+                float,
+                Perception,
+                float,
+                list[shapely.Polygon],
+                Attributes,
+                Buildings
+            ]]
+            kept: list[int]
+            kept, evaluated = self.evaluateCandidates(
+                [perceptionRotations[i] for i in chunk],
+                chunk,
+                query,
+                queryPolygon,
+                queryBuildings,
+                target,
+                threshold
+            )
+            pruned += len(chunk) - len(kept)
+            i: int
+            stats: tuple[
+                float,
+                Perception,
+                float,
+                list[shapely.Polygon],
+                Attributes,
+                Buildings
+            ]
+            for i, stats in zip(kept, evaluated):
+                # undefined distances, as from missing heights, rank last
+                distance: float = (
+                    math.inf if math.isnan(stats[0]) else stats[0])
+                item = (-distance, -i, stats)
+                if len(heap) < self.NUM_CONSIDERED_PERCEPTIONS:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+            if len(heap) >= self.NUM_CONSIDERED_PERCEPTIONS:
+                threshold = -heap[0][0]
+        with self.lock:
+            self.prunedCandidates += pruned
+            self.evaluatedCandidates += len(order) - pruned
+            print(
+                f"Pruned {pruned} of {len(order)} candidates by attribute "
+                f"bounds ({self.prunedCandidates} of "
+                f"{self.prunedCandidates + self.evaluatedCandidates} "
+                "in total)")
         perceptionStats: list[tuple[
             float,
             Perception,
@@ -68,54 +224,125 @@ class Collection:
             list[shapely.Polygon],
             Attributes,
             Buildings
+        ]] = [item[2] for item in sorted(heap, reverse=True)]
+        perceptionDistances: list[tuple[
+            float,
+            Perception,
+            float,
+            list[shapely.Polygon],
+            Attributes,
+            Buildings
         ]] = list()
-        attributesDistance: float
-        siteRegion: shapely.Polygon
-        achievable: Attributes
-        achievableBuildings: Buildings
-        print("Calculating attributes with found perceptions...")
-        perception: Perception
-        rotation: float
-        for perception, rotation in tqdm.tqdm(perceptionRotations):
+        print(
+            "Calculating distances for up to top "
+            f"{self.NUM_CONSIDERED_PERCEPTIONS} perceptions...")
+
+        def perceptionDistance(stats: tuple[
+            float,
+            Perception,
+            float,
+            list[shapely.Polygon],
+            Attributes,
+            Buildings
+        ]) -> float:
+            key: tuple[str, str, bytes] = (
+                "distance", stats[1].getId(), query.getFingerprint())
+            with self.lock:
+                distance: Optional[float] = self.cache.get(key)
+            if distance is None:
+                distance = stats[1].distanceTo(query, stats[2])
+                with self.lock:
+                    self.cache.put(key, distance)
+            return distance
+
+        for distance, stats in zip(
+            self.mapOrdered(perceptionDistance, tqdm.tqdm(perceptionStats)),
+            perceptionStats
+        ):
+            perceptionDistances.append((distance, *stats[1:]))
+        perceptionDistances.sort(key=lambda x: x[0])
+        print(self.cache)
+        return perceptionDistances[0][1:]
+
+    def evaluateCandidates(self,
+        perceptionRotations: list[tuple[Perception, float]],
+        indices: list[int],
+        query: Perception,
+        queryPolygon: shapely.Polygon,
+        queryBuildings: Buildings,
+        target: Attributes,
+        threshold: float
+    ) -> tuple[list[int], list[tuple[
+        float,
+        Perception,
+        float,
+        list[shapely.Polygon],
+        Attributes,
+        Buildings
+    ]]]:
+        # attributes achievable by each candidate placed at query, except
+        # those approximately known to be worse than threshold
+        destination: tuple[float, float] = (
+            query.getPoint().x, query.getPoint().y)
+        def placeCandidate(perceptionRotation: tuple[Perception, float]
+        ) -> tuple[list[shapely.Polygon], list[shapely.Polygon]]:
+            # regions of perception placed at destination and clipped to
+            # queryPolygon, and those regions back in query coordinates
+            perception: Perception
+            rotation: float
+            perception, rotation = perceptionRotation
             translation: tuple[float, float] = (
                 destination[0] - perception.getPoint().x,
                 destination[1] - perception.getPoint().y
             )
-            siteRegion = Geometric.rotateAboutTuple(
-                Geometric.translateVectorTuple(
-                    perception.getRegion(), translation),
-                destination,
-                rotation
-            ).intersection(queryPolygon) # type: ignore[attr-defined]
+            siteRegion: shapely.Geometry = Geometric.affineTransform(
+                perception.getRegion(),
+                Geometric.composeMatrices(
+                    Geometric.translationMatrix(translation),
+                    Geometric.rotationMatrix(destination, rotation))
+            ).intersection(queryPolygon)
             siteRegions: list[shapely.Polygon] = Geometric.geometryToPolygons(
                 siteRegion)
             siteRegions = list(
                 filter(lambda p: p.is_valid and not p.is_empty, siteRegions))
-            if len(siteRegions) <= 0:
-                achievable = Attributes.withMaxHeight(target)
-                achievableBuildings = Buildings.empty()
-            else:
-                queryRegions: list[shapely.Polygon] = [
-                    Geometric.translateVectorTuple( # type: ignore[misc]
-                        Geometric.rotateAboutTuple(
-                            region, destination, -rotation),
-                        (-translation[0], -translation[1])
-                    )
-                    for region in siteRegions]
-                achievable, achievableBuildings = queryBuildings.query(
-                    queryRegions)
-            attributesDistance = target.distanceTo(achievable)
-            perceptionStats.append((
-                attributesDistance,
-                perception,
-                rotation,
+            return siteRegions, Geometric.affineTransform(
                 siteRegions,
-                achievable,
-                achievableBuildings
-            ))
-        perceptionStats.sort(key=lambda x: x[0])
-        perceptionStats = perceptionStats[:self.NUM_CONSIDERED_PERCEPTIONS]
-        perceptionDistances: list[tuple[
+                Geometric.composeMatrices(
+                    Geometric.rotationMatrix(destination, -rotation),
+                    Geometric.translationMatrix(
+                        (-translation[0], -translation[1])))
+            ).tolist()
+
+        placed: list[tuple[list[shapely.Polygon], list[shapely.Polygon]]] = (
+            self.mapOrdered(placeCandidate, perceptionRotations))
+        candidateRegions: list[list[shapely.Polygon]] = [
+            siteRegions for siteRegions, _ in placed]
+        candidateQueryRegions: list[list[shapely.Polygon]] = [
+            queryRegions for _, queryRegions in placed]
+        nonEmpty: list[int] = [
+            j
+            for j, regions in enumerate(candidateQueryRegions)
+            if len(regions) > 0]
+        if Buildings.RASTER_RESOLUTION > 0 and math.isfinite(threshold):
+            nonEmpty = self.rankApproximately(
+                nonEmpty, candidateQueryRegions, queryBuildings, target,
+                threshold)
+        # buildings for every remaining candidate, in batches of a fixed size
+        # so results do not depend on the number of threads
+        batchSize: int = max(self.QUERY_BATCH_SIZE, 1)
+        queried: dict[int, tuple[Attributes, Buildings]] = dict(zip(
+            nonEmpty,
+            [
+                result
+                for results in self.mapOrdered(
+                    queryBuildings.queryMany,
+                    [
+                        [candidateQueryRegions[j] for j in nonEmpty[
+                            start:start + batchSize]]
+                        for start in range(0, len(nonEmpty), batchSize)])
+                for result in results]))
+        kept: list[int] = list()
+        evaluated: list[tuple[
             float,
             Perception,
             float,
@@ -123,60 +350,302 @@ class Collection:
             Attributes,
             Buildings
         ]] = list()
-        print(
-            "Calculating distances for up to top "
-            f"{self.NUM_CONSIDERED_PERCEPTIONS} perceptions...")
-        for (
-            attributesDistance,
-            perception,
-            rotation,
-            siteRegions,
-            achievable,
-            achievableBuildings
-        ) in tqdm.tqdm(perceptionStats):
-            distance: float = perception.distanceTo(query, rotation)
-            perceptionDistances.append((
-                distance,
+        j: int
+        for j, ((perception, rotation), siteRegions) in enumerate(zip(
+            perceptionRotations, candidateRegions
+        )):
+            achievable: Attributes
+            achievableBuildings: Buildings
+            if len(siteRegions) <= 0:
+                achievable = Attributes.withMaxHeight(target)
+                achievableBuildings = Buildings.empty()
+            elif not j in queried:
+                continue
+            else:
+                achievable, achievableBuildings = queried[j]
+            kept.append(indices[j])
+            evaluated.append((
+                target.distanceTo(achievable),
                 perception,
                 rotation,
                 siteRegions,
                 achievable,
                 achievableBuildings
             ))
-        perceptionDistances.sort(key=lambda x: x[0])
-        return perceptionDistances[0][1:]
+        return kept, evaluated
+
+    def mapOrdered(self,
+        function: Callable[[T], U],
+        items: CollectionType[T]
+    ) -> list[U]:
+        # results in the order of items, from a pool of NUM_THREADS threads
+        # if more than 1 since shapely releases the GIL
+        if self.NUM_THREADS <= 1 or len(items) <= 1:
+            return [function(item) for item in items]
+        with concurrent.futures.ThreadPoolExecutor(
+            min(self.NUM_THREADS, len(items))
+        ) as executor:
+            return list(executor.map(function, items))
+
+    def attributesLowerBounds(self,
+        perceptions: list[Perception],
+        queryBuildings: Buildings,
+        target: Attributes
+    ) -> np.ndarray:
+        # a candidate achieves at most the GFA and footprint within its whole
+        # region, so distanceTo is at least the shortfall of those to target
+        self.initRegionAttributes(queryBuildings)
+        bounds: np.ndarray = np.zeros(len(perceptions))
+        i: int
+        perception: Perception
+        for i, perception in enumerate(perceptions):
+            regionAttributes: Attributes = self.regionAttributes[
+                perception.getId()]
+            bounds[i] = sum([
+                target.RESIDENTIAL_WEIGHT * max(
+                    target.residentialGfa - regionAttributes.residentialGfa,
+                    0),
+                target.COMMERCIAL_WEIGHT * max(
+                    target.commercialGfa - regionAttributes.commercialGfa, 0),
+                target.CIVIC_WEIGHT * max(
+                    target.civicGfa - regionAttributes.civicGfa, 0),
+                target.OTHER_WEIGHT * max(
+                    target.otherGfa - regionAttributes.otherGfa, 0),
+                target.FOOTPRINT_WEIGHT * max(
+                    target.footprintArea - regionAttributes.footprintArea, 0)
+            ])
+        return bounds
+
+    def initRegionAttributes(self, queryBuildings: Buildings) -> None:
+        if self.regionBuildings is queryBuildings:
+            return
+        print("Calculating attributes of whole perception regions...")
+        self.regionAttributes = {
+            perception.getId(): attributes
+            for perception, (attributes, _) in zip(
+                self.perceptions,
+                queryBuildings.queryMany([
+                    [perception.getRegion()]
+                    for perception in self.perceptions]))}
+        self.regionBuildings = queryBuildings
     
+    def rankApproximately(self,
+        indices: list[int],
+        candidateQueryRegions: list[list[shapely.Polygon]],
+        queryBuildings: Buildings,
+        target: Attributes,
+        threshold: float
+    ) -> list[int]:
+        # candidates that may be better than threshold by attributes, given
+        # the error bounds of the approximate buildings engine
+        approximated: list[tuple[
+            Attributes,
+            Attributes
+        ]] = queryBuildings.approximateMany(
+            [candidateQueryRegions[i] for i in indices])
+        # undefined distances, as from missing heights, are never pruned,
+        # nor are candidates with invalid regions, on which queryMany
+        # predicates are undefined and so not bounded by the raster
+        kept: list[int] = [
+            i
+            for i, (estimate, error) in zip(indices, approximated)
+            if not (
+                target.distanceTo(estimate) - target.distanceError(error)
+                > threshold)
+            or not shapely.is_valid(candidateQueryRegions[i]).all()]
+        return kept
+
     def findRotations(self,
         query: Perception
     ) -> list[tuple[Perception, float]]:
-        perceptionRotations: list[tuple[Perception, float]] = list()
+        self.initDescriptorIndex()
         print(
             "Calculating rotations for "
             "perceptions in query with same cluster...")
-        perception: Perception
-        for perception in tqdm.tqdm(self.perceptions):
-            if perception.getCluster() != query.getCluster():
-                continue
-            rotation: float = perception.rotationTo(query)
-            perceptionRotations.append((perception, rotation))
-        if len(perceptionRotations) <= 0:
-            perceptionRotations = self.findRotationsSlow(query)
-        return perceptionRotations
+        indices: np.ndarray = self.clusterPerceptions.get(
+            query.getCluster(), np.zeros(0, dtype=np.int64))
+        if len(indices) <= 0:
+            return self.findRotationsSlow(query)
+        return self.rotationsFor(query, self.nearestCandidates(
+            query, indices, self.descriptorTrees[query.getCluster()]))
     
     def findRotationsSlow(self,
         query: Perception
     ) -> list[tuple[Perception, float]]:
-        perceptionRotations: list[tuple[Perception, float]] = list()
+        self.initDescriptorIndex()
         print(
             "No perceptions with same cluster found.\n"
             "Calculating rotations for all perceptions in query...")
+        return self.rotationsFor(query, self.nearestCandidates(
+            query,
+            np.arange(len(self.perceptions), dtype=np.int64),
+            self.descriptorTree
+        ))
+
+    def nearestCandidates(self,
+        query: Perception,
+        indices: np.ndarray,
+        tree: spatial.cKDTree
+    ) -> np.ndarray:
+        if not 0 < self.NUM_INDEXED_CANDIDATES < len(indices):
+            return indices
+        print(
+            f"Prefiltering {len(indices)} perceptions to "
+            f"{self.NUM_INDEXED_CANDIDATES} nearest by descriptor...")
+        descriptor: np.ndarray = query.descriptor(
+            self.rotationClusters.tolist(),
+            self.PERCEPTION_RADIUS,
+            self.DESCRIPTOR_BINS
+        ) / self.descriptorScale
+        nearest: np.ndarray
+        _, nearest = tree.query(descriptor, k=self.NUM_INDEXED_CANDIDATES)
+        return np.sort(indices[np.atleast_1d(nearest)])
+
+    def rotationsFor(self,
+        query: Perception,
+        indices: np.ndarray
+    ) -> list[tuple[Perception, float]]:
+        keys: list[tuple[str, str, bytes]] = [
+            ("rotation", self.perceptions[i].getId(), query.getFingerprint())
+            for i in indices]
+        with self.lock:
+            cached: list[Optional[float]] = [
+                self.cache.get(key) for key in keys]
+        missing: np.ndarray = np.array([
+            j for j, rotation in enumerate(cached) if rotation is None],
+            dtype=np.int64)
+        rotations: np.ndarray = np.array([
+            np.nan if rotation is None else rotation
+            for rotation in cached], dtype=np.float64)
+        if len(missing) > 0:
+            angles: np.ndarray
+            flips: np.ndarray
+            angles, flips = self.batchRotations(query, indices[missing])
+            rotations[missing] = angles + np.where(flips, math.pi, 0)
+            j: int
+            with self.lock:
+                for j in missing:
+                    self.cache.put(keys[j], float(rotations[j]))
+        return [
+            (self.perceptions[i], float(rotation))
+            for i, rotation in zip(indices, rotations)]
+
+    def initRotationIndex(self) -> None:
+        if self.rotationIndexed:
+            return
+        clusters: np.ndarray = np.array(sorted({
+            cluster
+            for perception in self.perceptions
+            for cluster in perception.sampleCounts()}), dtype=np.int64)
+        positions: dict[int, int] = {
+            int(cluster): i for i, cluster in enumerate(clusters)}
+        counts: np.ndarray = np.zeros(
+            (len(self.perceptions), len(clusters)), dtype=np.int64)
+        angles: np.ndarray = np.full(
+            (len(self.perceptions), len(clusters)), np.nan)
+        own: np.ndarray = np.zeros(len(self.perceptions), dtype=np.int64)
+        blockMembers: dict[tuple[int, int], list[int]] = dict()
+        i: int
         perception: Perception
-        for perception in tqdm.tqdm(self.perceptions):
-            rotation: float = perception.rotationTo(query)
-            perceptionRotations.append((perception, rotation))
-        if len(perceptionRotations) <= 0:
-            perceptionRotations = self.findRotationsSlow(query)
-        return perceptionRotations
+        for i, perception in enumerate(self.perceptions):
+            own[i] = positions[perception.getCluster()]
+            cluster: int
+            count: int
+            for cluster, count in perception.sampleCounts().items():
+                counts[i, positions[cluster]] = count
+                angles[i, positions[cluster]] = perception.svd[cluster][2]
+                blockMembers.setdefault(
+                    (positions[cluster], count), list()).append(i)
+        self.rotationClusters = clusters
+        self.rotationCounts = counts
+        self.rotationAngles = angles
+        self.rotationOwn = own
+        self.clusterPerceptions = {
+            int(cluster): np.flatnonzero(own == position)
+            for position, cluster in enumerate(clusters)}
+        # centred point blocks stacked by (cluster position, sample count)
+        self.rotationBlocks = {
+            key: (
+                np.array(members, dtype=np.int64),
+                np.stack([
+                    self.perceptions[member].sampleArrays[
+                        int(clusters[key[0]])]
+                    for member in members]))
+            for key, members in blockMembers.items()}
+        self.rotationIndexed = True
+
+    def initDescriptorIndex(self) -> None:
+        if self.descriptorIndexed:
+            return
+        self.initRotationIndex()
+        clusters: list[int] = self.rotationClusters.tolist()
+        descriptors: np.ndarray = np.stack([
+            perception.descriptor(
+                clusters, self.PERCEPTION_RADIUS, self.DESCRIPTOR_BINS)
+            for perception in self.perceptions])
+        scale: np.ndarray = descriptors.std(axis=0)
+        scale[scale <= 0] = 1
+        descriptors = descriptors / scale
+        self.descriptorScale = scale
+        self.descriptorTrees = {
+            cluster: spatial.cKDTree(descriptors[indices])
+            for cluster, indices in self.clusterPerceptions.items()}
+        self.descriptorTree = spatial.cKDTree(descriptors)
+        self.descriptorIndexed = True
+
+    def batchRotations(self,
+        query: Perception,
+        indices: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # vectorised Perception.rotationTo(query) for perceptions at indices,
+        # returning the angles and whether each is flipped by a further pi
+        queryCounts: dict[int, int] = query.sampleCounts()
+        queryCountsArray: np.ndarray = np.array([
+            queryCounts.get(int(cluster), 0)
+            for cluster in self.rotationClusters], dtype=np.int64)
+        queryAngles: np.ndarray = np.array([
+            query.svd[int(cluster)][2] if int(cluster) in query.svd else np.nan
+            for cluster in self.rotationClusters])
+        common: np.ndarray = np.minimum(
+            self.rotationCounts[indices], queryCountsArray)
+        own: np.ndarray = self.rotationOwn[indices]
+        rows: np.ndarray = np.arange(len(indices))
+        chosen: np.ndarray = np.where(
+            common[rows, own] > 0, own, np.argmax(common, axis=1))
+        shared: np.ndarray = common[rows, chosen] > 0
+        angles: np.ndarray = (
+            self.rotationAngles[indices, chosen] - queryAngles[chosen])
+        angles = np.where(
+            (math.pi < angles) & (angles <= 1.5 * math.pi),
+            angles - math.pi,
+            np.where(1.5 * math.pi < angles, angles - 2 * math.pi, angles))
+        angles = np.where(shared, angles, 0)
+        flips: np.ndarray = np.zeros(len(indices), dtype=np.bool_)
+        sizes: np.ndarray = self.rotationCounts[indices, chosen]
+        key: tuple[int, int]
+        for key in set(zip(chosen[shared].tolist(), sizes[shared].tolist())):
+            group: np.ndarray = np.flatnonzero(
+                shared & (chosen == key[0]) & (sizes == key[1]))
+            members: np.ndarray
+            blocks: np.ndarray
+            members, blocks = self.rotationBlocks[key]
+            selfPoints: np.ndarray = blocks[
+                np.searchsorted(members, indices[group])]
+            queryPoints: np.ndarray = query.sampleArrays[
+                int(self.rotationClusters[key[0]])]
+            cos: np.ndarray = np.cos(angles[group])
+            sin: np.ndarray = np.sin(angles[group])
+            # (k, 2, 2) row-vector rotation matrices, see Geometric.rotateArray
+            matrices: np.ndarray = np.stack((
+                np.stack((cos, sin), axis=1),
+                np.stack((-sin, cos), axis=1)), axis=1)
+            queryPointsRot: np.ndarray = queryPoints @ matrices
+            distance1: np.ndarray = Perception.TRANSPORT.distances(
+                selfPoints, queryPointsRot)
+            distance2: np.ndarray = Perception.TRANSPORT.distances(
+                selfPoints, -queryPointsRot)
+            flips[group] = distance2 > distance1
+        return angles, flips
 
     def filter(self, sitePolygons: list[shapely.Polygon]) -> Self:
         sitePerceptionZones: list[
@@ -186,19 +655,16 @@ class Collection:
             for sitePolygon in sitePolygons]))
         sitePerceptionZone: shapely.MultiPolygon = shapely.MultiPolygon(
             sitePerceptionZones)
-        newPerceptions: list[Perception] = list()
-        perception: Perception
-        for perception in self.perceptions:
-            if perception.getPoint().within(sitePerceptionZone):
-                newPerceptions.append(perception)
-        sampleSet: set[Sample] = set()
-        for perception in newPerceptions:
-            sampleSet.update(perception.getSamples())
-        return Collection.fromIdsPointsRegionsSamples(
-            [perception.getId() for perception in newPerceptions],
-            [perception.getPoint() for perception in newPerceptions],
-            [perception.getRegion() for perception in newPerceptions],
-            sampleSet
+        shapely.prepare(sitePerceptionZone)
+        points: np.ndarray = shapely.get_coordinates(
+            [perception.getPoint() for perception in self.perceptions]
+        ).reshape(-1, 2)
+        within: np.ndarray = np.flatnonzero(shapely.contains_xy(
+            sitePerceptionZone, points[:, 0], points[:, 1]))
+        # every sample in a kept region is already among its samples, so
+        # the kept perceptions are unchanged by the filter
+        return Collection(
+            [self.perceptions[i] for i in within]
         ) # type: ignore[return-value]
         
     def update(self,
@@ -207,49 +673,179 @@ class Collection:
         newRegions: Sequence[shapely.Polygon],
         newSamples: CollectionType[Sample]
     ) -> Self:
-        ids: list[str] = [perception.getId() for perception in self.perceptions]
-        points: list[shapely.Point] = [
-            perception.getPoint()
-            for perception in self.perceptions]
-        regions: list[shapely.Polygon] = [
-            perception.getRegion()
-            for perception in self.perceptions]
-        samples: set[Sample] = set(self.getSamples())
-        ids.extend(newIds)
-        points.extend(newPoints)
-        regions.extend(newRegions)
-        samples.update(newSamples)
-        return Collection.fromIdsPointsRegionsSamples(
-            ids, points, regions, samples) # type: ignore[return-value]
+        print("Updating collection...")
+        if len(newIds) != len(newPoints) or len(newIds) != len(newRegions):
+            raise ValueError("Number of ids, points, and regions must match!")
+        self.initSampleIndex()
+        assert self.samples is not None
+        assert self.sampleTable is not None
+        assert self.sampleIndex is not None
+        assert self.regionIndex is not None
+        # existing samples are distinct, so they keep their ids and new
+        # samples not among them follow in order of first appearance
+        combined: SampleTable
+        combined, _ = self.sampleTable.append(
+            SampleTable.fromSamples(newSamples)).unique()
+        candidateTable: SampleTable = combined.take(
+            np.arange(len(self.samples), len(combined)))
+        candidates: list[Sample] = candidateTable.toSamples()
+        regionIndex: SpatialIndex = self.regionIndex.append(newRegions)
+        # (candidate index, perception index) for every new sample in every
+        # existing or new region, as Perception.clipSamples would select
+        candidatePairs: np.ndarray = regionIndex.query(
+            [sample.getPoint() for sample in candidates],
+            predicate="intersects")
+        added: np.ndarray = np.unique(candidatePairs[0])
+        sampleIds: np.ndarray = np.full(len(candidates), -1, dtype=np.int64)
+        sampleIds[added] = len(self.samples) + np.arange(len(added))
+        samples: tuple[Sample, ...] = self.samples + tuple(
+            candidates[i] for i in added)
+        sampleIndex: SpatialIndex = self.sampleIndex.append(
+            [candidates[i].getPoint() for i in added])
+        perceptions: list[Perception] = list(self.perceptions)
+        # existing perceptions whose regions receive new samples
+        affectedPairs: np.ndarray = np.stack((
+            candidatePairs[1], sampleIds[candidatePairs[0]]))
+        affectedPairs = affectedPairs[
+            :, affectedPairs[0] < len(self.perceptions)]
+        affectedPairs = affectedPairs[
+            :, np.lexsort((affectedPairs[1], affectedPairs[0]))]
+        affected: np.ndarray
+        starts: np.ndarray
+        affected, starts = np.unique(affectedPairs[0], return_index=True)
+        ends: np.ndarray = np.append(starts[1:], affectedPairs.shape[1])
+        i: int
+        for i, start, end in zip(affected, starts, ends):
+            perception: Perception = self.perceptions[i]
+            perceptions[i] = Perception(
+                perception.getId(),
+                perception.getPoint(),
+                perception.getRegion(),
+                list(perception.getSamples()) + [
+                    samples[j] for j in affectedPairs[1, start:end]],
+                clip=False
+            )
+        # new perceptions take every sample in their regions
+        newPairs: np.ndarray = sampleIndex.query(
+            newRegions, predicate="intersects")
+        newPairs = newPairs[:, np.lexsort((newPairs[1], newPairs[0]))]
+        offsets: np.ndarray = np.searchsorted(
+            newPairs[0], np.arange(len(newRegions) + 1))
+        for i in range(len(newIds)):
+            perceptions.append(Perception(
+                newIds[i],
+                newPoints[i],
+                newRegions[i],
+                [samples[j] for j in newPairs[1, offsets[i]:offsets[i + 1]]],
+                clip=False
+            ))
+        # the lookup, if built, is extended rather than rebuilt, with updated
+        # perceptions in place of those they replace
+        perceptionLookup: Optional[
+            dict[tuple[float, float, int], Perception]] = None
+        if self.perceptionLookup is not None:
+            perceptionLookup = dict(self.perceptionLookup)
+            for i in affected:
+                key: tuple[float, float, int] = Collection.perceptionKey(
+                    self.perceptions[i])
+                if perceptionLookup[key] is self.perceptions[i]:
+                    perceptionLookup[key] = perceptions[i]
+            Collection.extendPerceptionLookup(
+                perceptionLookup, perceptions[len(self.perceptions):])
+        print(
+            f"Reused {len(self.perceptions) - len(affected)}, "
+            f"updated {len(affected)}, and added {len(newIds)} perceptions")
+        return Collection(
+            perceptions,
+            samples,
+            sampleIndex,
+            regionIndex,
+            self.sampleTable.append(candidateTable.take(added)),
+            perceptionLookup
+        ) # type: ignore[return-value]
+
+    def initSampleIndex(self) -> None:
+        if self.samples is None:
+            self.sampleTable, _ = SampleTable.fromSamples([
+                sample
+                for perception in self.perceptions
+                for sample in perception.getSamples()]).unique()
+            self.samples = tuple(self.sampleTable.toSamples())
+        if self.sampleTable is None:
+            self.sampleTable = SampleTable.fromSamples(self.samples)
+        if self.sampleIndex is None:
+            self.sampleIndex = SpatialIndex(
+                [sample.getPoint() for sample in self.samples])
+        if self.regionIndex is None:
+            self.regionIndex = SpatialIndex(
+                [perception.getRegion() for perception in self.perceptions])
     
     def getSamples(self) -> list[Sample]:
-        sampleSet: set[Sample] = set()
-        perception: Perception
-        for perception in self.perceptions:
-            sampleSet.update(perception.getSamples())
-        return list(sampleSet)
+        self.initSampleIndex()
+        assert self.samples is not None
+        return list(self.samples)
     
-    def samplesInPolygon(self, polygon: shapely.Polygon) -> list[Sample]:
-        sampleSet: set[Sample] = set()
-        perception: Perception
-        for perception in self.perceptions:
-            sampleSet.update(perception.samplesInPolygon(polygon))
-        return list(sampleSet)
+    def getSampleTable(self) -> SampleTable:
+        self.initSampleIndex()
+        assert self.sampleTable is not None
+        return self.sampleTable
+
+    def samplesInPolygon(self,
+        polygon: Union[shapely.Polygon, shapely.MultiPolygon]
+    ) -> list[Sample]:
+        self.initSampleIndex()
+        assert self.samples is not None
+        return [self.samples[i] for i in self.sampleIdsInPolygon(polygon)]
+
+    def sampleIdsInPolygon(self,
+        polygon: Union[shapely.Polygon, shapely.MultiPolygon]
+    ) -> np.ndarray:
+        # ids are rows of sampleTable and positions in samples
+        self.initSampleIndex()
+        assert self.sampleTable is not None
+        assert self.sampleIndex is not None
+        candidates: np.ndarray = np.sort(
+            self.sampleIndex.query([polygon])[1])
+        return candidates[
+            self.sampleTable.take(candidates).within(polygon)]
     
+    def initPerceptionLookup(self) -> None:
+        if self.perceptionLookup is not None:
+            return
+        self.perceptionLookup = Collection.extendPerceptionLookup(
+            dict(), self.perceptions)
+
+    @staticmethod
+    def extendPerceptionLookup(
+        lookup: dict[tuple[float, float, int], Perception],
+        perceptions: Sequence[Perception]
+    ) -> dict[tuple[float, float, int], Perception]:
+        # perceptions matching a sample all lie at distance 0 from it, so
+        # the nearest is the first in order
+        perception: Perception
+        for perception in perceptions:
+            lookup.setdefault(
+                Collection.perceptionKey(perception), perception)
+        return lookup
+
+    @staticmethod
+    def perceptionKey(perception: Perception) -> tuple[float, float, int]:
+        return (
+            perception.getPoint().x,
+            perception.getPoint().y,
+            perception.getCluster()
+        )
+
     def perceptionFromSample(self, sample: Sample) -> Perception:
-        matchingPerceptions: list[Perception] = list(filter(
-            (lambda p: Sample(p.getPoint(), p.getCluster()) == sample),
-            self.perceptions
-        ))
-        if len(matchingPerceptions) <= 0:
+        self.initPerceptionLookup()
+        assert self.perceptionLookup is not None
+        perception: Optional[Perception] = self.perceptionLookup.get(
+            sample.key())
+        if perception is None:
             raise IndexError(
                 f"No perception in {self.__repr__()} "
                 f"found from {sample.__repr__()}!")
-        perceptionDistances: list[tuple[float, Perception]] = [
-            (perception.getPoint().distance(sample.getPoint()), perception)
-            for perception in matchingPerceptions]
-        perceptionDistances.sort(key=lambda x: x[0])
-        return perceptionDistances[0][1]
+        return perception
     
     def getPerceptions(self) -> list[Perception]:
         return list(self.perceptions)
\ No newline at end of file
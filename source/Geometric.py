@@ -1,7 +1,8 @@
+import numpy as np
 import shapely
 
 import math
-from typing import Optional, Sequence
+from typing import Any, Optional, Sequence
 
 class Geometric:
     @staticmethod
@@ -20,21 +21,39 @@ class Geometric:
     @staticmethod
     def voronoiPolygons(points: list[shapely.Point],
         extendTo: Optional[shapely.Geometry] = None) -> list[shapely.Polygon]:
+        # cells in order of points; repeated points get an empty polygon, and
+        # a single distinct point gets the envelope of itself and extendTo
+        coords: np.ndarray = shapely.get_coordinates(points).reshape(-1, 2)
+        firsts: np.ndarray
+        inverse: np.ndarray
+        _, firsts, inverse = np.unique(
+            coords, axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        sortedPolygons: list[shapely.Polygon] = [
+            shapely.Polygon() for _ in points]
+        if len(firsts) <= 0:
+            return sortedPolygons
+        if len(firsts) <= 1:
+            if extendTo is None:
+                raise ValueError(
+                    f"Voronoi for {points.__repr__()} needs extendTo "
+                    "when there are fewer than 2 distinct points!")
+            sortedPolygons[firsts[0]] = shapely.envelope(
+                shapely.GeometryCollection([extendTo, points[firsts[0]]]))
+            return sortedPolygons
         polygons: list[shapely.Polygon] = Geometric.geometryToPolygons(
             shapely.voronoi_polygons(
-                shapely.MultiPoint(points), extend_to=extendTo))
-        sortedPolygons: list[shapely.Polygon] = list()
-        point: shapely.Point
-        for point in points:
-            polygon: shapely.Polygon
-            for polygon in polygons:
-                if point.within(polygon):
-                    polygons.remove(polygon)
-                    sortedPolygons.append(polygon)
-                    break
+                shapely.MultiPoint(coords[firsts]), extend_to=extendTo))
+        # (point index, polygon index) with each point inside one polygon
+        pairs: np.ndarray = shapely.STRtree(polygons).query(
+            [points[i] for i in firsts], predicate="within")
         assert (
-            len(sortedPolygons) == len(points)
+            len(np.unique(pairs[0])) == len(firsts)
         ), f"Could not find voronoi for {points.__repr__()}!"
+        i: int
+        j: int
+        for i, j in zip(firsts[pairs[0]], pairs[1]):
+            sortedPolygons[i] = polygons[j]
         return sortedPolygons
 
     @staticmethod
@@ -96,24 +115,9 @@ class Geometric:
         geometry: object,
         vector: tuple[float, float]
     ) -> object:
-        if isinstance(geometry, shapely.Point):
-            return Geometric.translatePoint(geometry, vector)
-        if isinstance(geometry, shapely.LineString):
-            raise NotImplementedError("LineString not implemented!")
-        if isinstance(geometry, shapely.LinearRing):
-            raise NotImplementedError("LinearRing not implemented!")
-        if isinstance(geometry, shapely.Polygon):
-            return Geometric.translatePolygon(geometry, vector)
-        if isinstance(geometry, shapely.MultiPoint):
-            raise NotImplementedError("MultiPoint not implemented!")
-        if isinstance(geometry, shapely.MultiLineString):
-            raise NotImplementedError("MultiLineString not implemented!")
-        if isinstance(geometry, shapely.MultiPolygon):
-            return shapely.MultiPolygon([
-                Geometric.translatePolygon(polygon, vector)
-                for polygon in geometry.geoms])
-        if isinstance(geometry, shapely.GeometryCollection):
-            raise NotImplementedError("GeometryCollection not implemented!")
+        if isinstance(geometry, shapely.Geometry):
+            return Geometric.affineTransform(
+                geometry, Geometric.translationMatrix(vector))
         if isinstance(geometry, Sequence):
             Geometric.checkSequence2Float(geometry)
             return Geometric.translateTuple((geometry[0], geometry[1]), vector)
@@ -124,23 +128,16 @@ class Geometric:
         geometry: shapely.Point,
         vector: tuple[float, float]
     ) -> shapely.Point:
-        return shapely.Point(
-            Geometric.translateTuple((geometry.x, geometry.y), vector))
+        return Geometric.affineTransform(
+            geometry, Geometric.translationMatrix(vector))
     
     @staticmethod
     def translatePolygon(
         geometry: shapely.Polygon,
         vector: tuple[float, float]
     ) -> shapely.Polygon:
-        exterior: list[shapely.Point] = [
-            Geometric.translatePoint(shapely.Point(point), vector)
-            for point in geometry.exterior.coords]
-        interiors: list[list[shapely.Point]] = [
-            [
-                Geometric.translatePoint(shapely.Point(point), vector)
-                for point in interior.coords]
-            for interior in geometry.interiors]
-        return shapely.Polygon(shell=exterior, holes=interiors)
+        return Geometric.affineTransform(
+            geometry, Geometric.translationMatrix(vector))
     
     @staticmethod
     def translateTuple(
@@ -174,24 +171,9 @@ class Geometric:
         origin: tuple[float, float],
         rotation: float
     ) -> object:
-        if isinstance(geometry, shapely.Point):
-            return Geometric.rotatePoint(geometry, origin, rotation)
-        if isinstance(geometry, shapely.LineString):
-            raise NotImplementedError("LineString not implemented!")
-        if isinstance(geometry, shapely.LinearRing):
-            raise NotImplementedError("LinearRing not implemented!")
-        if isinstance(geometry, shapely.Polygon):
-            return Geometric.rotatePolygon(geometry, origin, rotation)
-        if isinstance(geometry, shapely.MultiPoint):
-            raise NotImplementedError("MultiPoint not implemented!")
-        if isinstance(geometry, shapely.MultiLineString):
-            raise NotImplementedError("MultiLineString not implemented!")
-        if isinstance(geometry, shapely.MultiPolygon):
-            return shapely.MultiPolygon([
-                Geometric.rotatePolygon(polygon, origin, rotation)
-                for polygon in geometry.geoms])
-        if isinstance(geometry, shapely.GeometryCollection):
-            raise NotImplementedError("GeometryCollection not implemented!")
+        if isinstance(geometry, shapely.Geometry):
+            return Geometric.affineTransform(
+                geometry, Geometric.rotationMatrix(origin, rotation))
         if isinstance(geometry, Sequence):
             Geometric.checkSequence2Float(geometry)
             return Geometric.rotateTuple(
@@ -204,8 +186,8 @@ class Geometric:
         origin: tuple[float, float],
         rotation: float
     ) -> shapely.Point:
-        return shapely.Point(
-            Geometric.rotateTuple((geometry.x, geometry.y), origin, rotation))
+        return Geometric.affineTransform(
+            geometry, Geometric.rotationMatrix(origin, rotation))
     
     @staticmethod
     def rotatePolygon(
@@ -213,15 +195,8 @@ class Geometric:
         origin: tuple[float, float],
         rotation: float
     ) -> shapely.Polygon:
-        exterior: list[shapely.Point] = [
-            Geometric.rotatePoint(shapely.Point(point), origin, rotation)
-            for point in geometry.exterior.coords]
-        interiors: list[list[shapely.Point]] = [
-            [
-                Geometric.rotatePoint(shapely.Point(point), origin, rotation)
-                for point in interior.coords]
-            for interior in geometry.interiors]
-        return shapely.Polygon(shell=exterior, holes=interiors)
+        return Geometric.affineTransform(
+            geometry, Geometric.rotationMatrix(origin, rotation))
     
     @staticmethod
     def rotateTuple(
@@ -236,7 +211,62 @@ class Geometric:
         xNew: float = xRot + origin[0]
         yNew: float = yRot + origin[1]
         return (xNew, yNew)
+
+    @staticmethod
+    def rotateArray(
+        array: np.ndarray,
+        origin: tuple[float, float],
+        rotation: float
+    ) -> np.ndarray:
+        cos: float = math.cos(rotation)
+        sin: float = math.sin(rotation)
+        matrix: np.ndarray = np.array(((cos, sin), (-sin, cos)))
+        return (array - origin) @ matrix + origin
     
+    @staticmethod
+    def translationMatrix(vector: tuple[float, float]) -> np.ndarray:
+        return np.array(((1, 0, vector[0]), (0, 1, vector[1])), dtype=float)
+
+    @staticmethod
+    def rotationMatrix(
+        origin: tuple[float, float],
+        rotation: float
+    ) -> np.ndarray:
+        # counterclockwise rotation about origin, as in rotateTuple
+        cos: float = math.cos(rotation)
+        sin: float = math.sin(rotation)
+        return np.array((
+            (cos, -sin, origin[0] - cos * origin[0] + sin * origin[1]),
+            (sin, cos, origin[1] - sin * origin[0] - cos * origin[1])))
+
+    @staticmethod
+    def composeMatrices(*matrices: np.ndarray) -> np.ndarray:
+        # single 2x3 affine matrix applying matrices in the given order
+        composed: np.ndarray = np.eye(3)
+        matrix: np.ndarray
+        for matrix in matrices:
+            composed = np.vstack((matrix, (0, 0, 1))) @ composed
+        return composed[:2]
+
+    @staticmethod
+    def affineArray(array: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        # applies a 2x3 affine matrix to an (n, 2) coordinate array
+        return np.stack((
+            array[:, 0] * matrix[0, 0]
+            + array[:, 1] * matrix[0, 1] + matrix[0, 2],
+            array[:, 0] * matrix[1, 0]
+            + array[:, 1] * matrix[1, 1] + matrix[1, 2]
+        ), axis=1)
+
+    @staticmethod
+    def affineTransform(geometry: Any, matrix: np.ndarray) -> Any:
+        # applies a 2x3 affine matrix to a geometry or an array of geometries
+        # of any type, returning the same shape
+        if isinstance(geometry, (list, tuple)):
+            geometry = np.array(geometry, dtype=object)
+        return shapely.transform(
+            geometry, lambda coords: Geometric.affineArray(coords, matrix))
+
     @staticmethod
     def checkSequence2Float(sequence: Sequence[object]) -> None:
         x: object
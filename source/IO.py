@@ -1,4 +1,5 @@
 import geopandas # type: ignore[import-untyped]
+import numpy as np
 import pandas as pd
 import shapely
 
@@ -8,59 +9,237 @@ from .Collection import Collection
 from .Geometric import Geometric
 from .Perception import Perception
 from .Sample import Sample
+from .SampleTable import SampleTable
 
 import csv
+import hashlib
+import importlib.util
 import json
 import os
 from os import path
 import pathlib
+import tempfile
+from typing import Optional, Sequence
+import zipfile
 
 class IO:
+    CACHE_PREPARED: bool = True
+    PREPARED_VERSION: int = 1
+    USE_ARROW: bool = importlib.util.find_spec("pyarrow") is not None
+
     @staticmethod
     def initCollection(
         points_geojson: str,
         regions_geojson: str,
         cluster_csv: str
     ) -> Collection:
-        pointsGdf: geopandas.GeoDataFrame
-        with open(points_geojson, 'r') as fp:
-            pointsGdf = geopandas.read_file(fp)
-            pointsGdf = pointsGdf.set_index("id", drop=True)
-        regionsGdf: geopandas.GeoDataFrame
-        with open(regions_geojson, 'r') as fp:
-            regionsGdf = geopandas.read_file(fp)
-            regionsGdf = regionsGdf.set_index("id", drop=True)
+        preparedNpz: str = f"{points_geojson}.prepared.npz"
+        key: str = ""
+        if IO.CACHE_PREPARED:
+            key = IO.hashFiles((points_geojson, regions_geojson, cluster_csv))
+            prepared: Optional[Collection] = IO.readPrepared(preparedNpz, key)
+            if prepared is not None:
+                print(f"Loaded prepared collection from {preparedNpz}")
+                return prepared
+        pointsGdf: geopandas.GeoDataFrame = IO.readGeoJson(
+            points_geojson).set_index("id", drop=True)
+        regionsGdf: geopandas.GeoDataFrame = IO.readGeoJson(
+            regions_geojson).set_index("id", drop=True)
         clusterDf: pd.DataFrame
         with open(cluster_csv, 'r') as fp:
             clusterDf = pd.read_csv(fp, header=0, index_col="id")
-        ids: list[str] = list()
-        points: list[shapely.Point] = list()
-        regions: list[shapely.Polygon] = list()
-        samples: list[Sample] = list()
-        row: pd.Series
-        for id, row in pointsGdf.iterrows():
-            if not id in regionsGdf.index:
-                print(f"{id} not in {regions_geojson}!")
-                continue
-            if not id in clusterDf.index:
-                print(f"{id} not in {cluster_csv}!")
-                continue
-            point: shapely.Point = row["geometry"]
-            assert isinstance(point, shapely.Point)
-            region: shapely.Polygon = regionsGdf.loc[id]["geometry"]
-            assert isinstance(region, shapely.Polygon)
-            cluster = clusterDf.loc[id]["cluster"]
-            try:
-                int(cluster)
-            except ValueError:
-                raise ValueError("Cluster values must be castable to int!")
-            sample: Sample = Sample(point, int(cluster))
-            ids.append(str(id))
-            points.append(point)
-            regions.append(region)
-            samples.append(sample)
-        return Collection.fromIdsPointsRegionsSamples(
-            ids, points, regions, samples)
+        # points with both a region and a cluster, in order of points
+        inRegions: np.ndarray = pointsGdf.index.isin(regionsGdf.index)
+        inClusters: np.ndarray = pointsGdf.index.isin(clusterDf.index)
+        keptGdf: geopandas.GeoDataFrame = pointsGdf[inRegions & inClusters]
+        if len(keptGdf) < len(pointsGdf):
+            dropped: list[str] = [
+                str(id) for id in pointsGdf.index[~(inRegions & inClusters)]]
+            print(
+                f"Dropped {len(dropped)} of {len(pointsGdf)} points: "
+                f"{np.count_nonzero(~inRegions)} not in {regions_geojson}, "
+                f"{np.count_nonzero(~inClusters)} not in {cluster_csv} "
+                f"({', '.join(dropped[:10])}"
+                f"{', ...' if len(dropped) > 10 else ''})")
+        points: np.ndarray = keptGdf.geometry.to_numpy()
+        assert np.all(shapely.get_type_id(points) == shapely.GeometryType.POINT)
+        regions: np.ndarray = regionsGdf.geometry.reindex(
+            keptGdf.index).to_numpy()
+        assert np.all(
+            shapely.get_type_id(regions) == shapely.GeometryType.POLYGON)
+        # missing or fractional clusters would otherwise be cast silently
+        clusterValues: np.ndarray
+        try:
+            clusterValues = clusterDf["cluster"].reindex(
+                keptGdf.index).to_numpy(dtype=np.float64, na_value=np.nan)
+        except (TypeError, ValueError):
+            raise ValueError("Cluster values must be castable to int!")
+        if not np.all(np.isfinite(clusterValues)) or np.any(
+            clusterValues != np.trunc(clusterValues)):
+            raise ValueError("Cluster values must be castable to int!")
+        clusters: np.ndarray = clusterValues.astype(np.int64)
+        ids: list[str] = [str(id) for id in keptGdf.index]
+        samples: list[Sample] = [
+            Sample(point, cluster)
+            for point, cluster in zip(points.tolist(), clusters.tolist())]
+        collection: Collection = Collection.fromIdsPointsRegionsSamples(
+            ids, points.tolist(), regions.tolist(), samples)
+        if IO.CACHE_PREPARED:
+            IO.writePrepared(preparedNpz, key, collection)
+        return collection
+
+    @staticmethod
+    def readGeoJson(geojson: str) -> geopandas.GeoDataFrame:
+        # through pyogrio, with Arrow if pyarrow is installed
+        return geopandas.read_file(
+            geojson, engine="pyogrio", use_arrow=IO.USE_ARROW)
+
+    @staticmethod
+    def hashFiles(paths: Sequence[str]) -> str:
+        digest = hashlib.sha256(str(IO.PREPARED_VERSION).encode())
+        filePath: str
+        for filePath in paths:
+            with open(filePath, 'rb') as fp:
+                chunk: bytes
+                for chunk in iter(lambda: fp.read(1 << 20), b""):
+                    digest.update(chunk)
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    @staticmethod
+    def readPrepared(prepared_npz: str, key: str) -> Optional[Collection]:
+        if not path.exists(prepared_npz):
+            return None
+        try:
+            with np.load(prepared_npz, allow_pickle=False) as prepared:
+                if str(prepared["key"]) != key:
+                    print(f"{prepared_npz} is stale!")
+                    return None
+                arrays: dict[str, np.ndarray] = {
+                    name: prepared[name] for name in prepared.files}
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            print(f"Could not read {prepared_npz}: {e}")
+            return None
+        samples: list[Sample] = [
+            Sample(point, int(cluster))
+            for point, cluster in zip(
+                shapely.points(arrays["sampleCoords"]).tolist(),
+                arrays["sampleClusters"])]
+        points: list[shapely.Point] = shapely.points(
+            arrays["points"]).tolist()
+        regionBytes: bytes = arrays["regionBytes"].tobytes()
+        regionOffsets: np.ndarray = arrays["regionOffsets"]
+        regions: list[shapely.Polygon] = shapely.from_wkb([
+            regionBytes[regionOffsets[i]:regionOffsets[i + 1]]
+            for i in range(len(points))]).tolist()
+        sampleOffsets: np.ndarray = arrays["sampleOffsets"]
+        sampleIndices: np.ndarray = arrays["sampleIndices"]
+        svdOffsets: np.ndarray = arrays["svdOffsets"]
+        perceptions: list[Perception] = list()
+        i: int
+        for i in range(len(points)):
+            svd: dict[int, tuple[np.float64, np.ndarray, float]] = {
+                int(arrays["svdClusters"][j]): (
+                    arrays["svdValues"][j],
+                    arrays["svdVectors"][j],
+                    arrays["svdAngles"][j]
+                )
+                for j in range(svdOffsets[i], svdOffsets[i + 1])}
+            perceptions.append(Perception(
+                str(arrays["ids"][i]),
+                points[i],
+                regions[i],
+                [
+                    samples[j]
+                    for j in sampleIndices[
+                        sampleOffsets[i]:sampleOffsets[i + 1]]],
+                clip=False,
+                cluster=int(arrays["clusters"][i]),
+                svd=svd
+            ))
+        return Collection(
+            perceptions,
+            samples,
+            sampleTable=SampleTable(
+                arrays["sampleCoords"][:, 0],
+                arrays["sampleCoords"][:, 1],
+                arrays["sampleClusters"]))
+
+    @staticmethod
+    def writePrepared(
+        prepared_npz: str,
+        key: str,
+        collection: Collection
+    ) -> None:
+        perceptions: list[Perception] = collection.getPerceptions()
+        samples: list[Sample] = collection.getSamples()
+        sampleIndex: dict[Sample, int] = {
+            sample: i for i, sample in enumerate(samples)}
+        regionsWkb: list[bytes] = shapely.to_wkb(
+            [perception.getRegion() for perception in perceptions]).tolist()
+        svds: list[tuple[int, tuple[np.float64, np.ndarray, float]]] = [
+            item
+            for perception in perceptions
+            for item in perception.svd.items()]
+        # a unique temporary file beside prepared_npz, so concurrent runs do
+        # not write to the same one and the replace stays on one filesystem
+        tmpNpz: Optional[str] = None
+        try:
+            fd: int
+            fd, tmpNpz = tempfile.mkstemp(
+                suffix=".tmp",
+                dir=path.dirname(path.abspath(prepared_npz)))
+            with os.fdopen(fd, 'wb') as fp:
+                np.savez(
+                    fp,
+                    key=np.array(key),
+                    ids=np.array(
+                        [perception.getId() for perception in perceptions],
+                        dtype=np.str_),
+                    points=shapely.get_coordinates(
+                        [perception.getPoint() for perception in perceptions]
+                    ).reshape(-1, 2),
+                    regionBytes=np.frombuffer(
+                        b"".join(regionsWkb), dtype=np.uint8),
+                    regionOffsets=np.cumsum(
+                        [0] + [len(wkb) for wkb in regionsWkb]),
+                    sampleCoords=shapely.get_coordinates(
+                        [sample.getPoint() for sample in samples]
+                    ).reshape(-1, 2),
+                    sampleClusters=np.array(
+                        [sample.getCluster() for sample in samples],
+                        dtype=np.int64),
+                    sampleOffsets=np.cumsum([0] + [
+                        len(perception.getSamples())
+                        for perception in perceptions]),
+                    sampleIndices=np.array([
+                        sampleIndex[sample]
+                        for perception in perceptions
+                        for sample in perception.getSamples()],
+                        dtype=np.int64),
+                    clusters=np.array(
+                        [perception.getCluster() for perception in perceptions],
+                        dtype=np.int64),
+                    svdOffsets=np.cumsum([0] + [
+                        len(perception.svd) for perception in perceptions]),
+                    svdClusters=np.array(
+                        [cluster for cluster, _ in svds], dtype=np.int64),
+                    svdValues=np.array(
+                        [svd[0] for _, svd in svds], dtype=np.float64),
+                    svdVectors=np.array(
+                        [svd[1] for _, svd in svds],
+                        dtype=np.float64).reshape(-1, 2),
+                    svdAngles=np.array(
+                        [svd[2] for _, svd in svds], dtype=np.float64)
+                )
+            os.replace(tmpNpz, prepared_npz)
+            tmpNpz = None
+            print(f"Wrote prepared collection to {prepared_npz}")
+        except OSError as e:
+            print(f"Could not write {prepared_npz}: {e}")
+        finally:
+            if tmpNpz is not None and path.exists(tmpNpz):
+                os.remove(tmpNpz)
 
     @staticmethod
     def initPolygons(
@@ -176,11 +355,13 @@ class IO:
             csvwriter.writerows(rows)
         ids: list[str] = [row[0] for row in rows]
         multiPolygons: list[shapely.MultiPolygon] = [
-            Geometric.translateOD( # type: ignore[misc]
-                Geometric.rotateAboutShapely(
-                    shapely.MultiPolygon(g[3]), g[1], -g[2]),
-                g[1],
-                g[0].getPoint()
+            Geometric.affineTransform(
+                shapely.MultiPolygon(g[3]),
+                Geometric.composeMatrices(
+                    Geometric.rotationMatrix((g[1].x, g[1].y), -g[2]),
+                    Geometric.translationMatrix((
+                        g[0].getPoint().x - g[1].x,
+                        g[0].getPoint().y - g[1].y)))
             )
             for g in generation]
         polygonsGdf: geopandas.GeoDataFrame = geopandas.GeoDataFrame(
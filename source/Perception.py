@@ -1,37 +1,55 @@
-import geopandas # type: ignore[import-untyped]
 import numpy as np
 from scipy import linalg # type: ignore[import-untyped]
-from scipy import stats # type: ignore[import-untyped]
 import shapely
 
 from .Geometric import Geometric
 from .Sample import Sample
+from .Transport import Transport
+import hashlib
 import math
-from typing import Collection, Self, Union
+from typing import Collection, Optional, Self, Sequence, Union
 
 class Perception:
+    TRANSPORT: Transport = Transport()
+
     def __init__(self,
         id: str,
         point: shapely.Point,
         region: shapely.Polygon,
-        samples: Collection[Sample]
+        samples: Collection[Sample],
+        clip: bool = True,
+        cluster: Optional[int] = None,
+        svd: Optional[dict[int, tuple[np.float64, np.ndarray, float]]] = None
     ) -> None:
+        # clip may be False when samples are already known to be in region,
+        # and cluster and svd may be given when restored from a cache
         samplesClip: tuple[Sample, ...] = tuple(
-            Perception.clipSamples(samples, region))
+            Perception.clipSamples(samples, region) if clip else samples)
         sampleMap: dict[int, tuple[Sample, ...]] = Perception.mapSamples(
             samples)
+        sampleCoords: np.ndarray = Perception.sampleCoordinates(samplesClip)
+        sampleArrays: dict[int, np.ndarray] = Perception.initSampleArrays(
+            point, sampleMap)
         self.id: str = id
         self.point: shapely.Point = point
-        self.cluster: int = Perception.findCluster(point, samplesClip)
+        self.cluster: int = (
+            Perception.findCluster(point, samplesClip, sampleCoords)
+            if cluster is None else cluster)
         self.region: shapely.Polygon = region
-        self.samples: tuple[Sample, ...] = tuple(samplesClip)
+        self.samples: tuple[Sample, ...] = samplesClip
         self.sampleMap: dict[int, tuple[Sample, ...]] = sampleMap
+        # (n, 2) absolute coordinates of samples, aligned with self.samples
+        self.sampleCoords: np.ndarray = sampleCoords
+        # dict[cluster, (n, 2) coordinates of samples relative to point]
+        self.sampleArrays: dict[int, np.ndarray] = sampleArrays
         # dict[cluster, tuple[singularValue, rightSingularVector, angle]]
         self.svd: dict[int, tuple[
             np.float64,
             np.ndarray,
             float
-        ]] = Perception.initSvd(point, sampleMap)
+        ]] = Perception.initSvd(sampleArrays) if svd is None else svd
+        self.fingerprint: bytes = Perception.initFingerprint(
+            point, self.cluster, sampleArrays)
 
     def __repr__(self) -> str:
         return (
@@ -44,57 +62,96 @@ class Perception:
         polygon: shapely.Polygon
     ) -> list[Sample]:
         samplesList: list[Sample] = list(samples)
-        return geopandas.GeoDataFrame(
-            data={"sample": samplesList},
-            geometry=[sample.getPoint() for sample in samplesList]
-        ).clip(polygon, keep_geom_type=True)["sample"].to_list()
+        # same selection as GeoDataFrame.clip on points, in input order
+        intersects: np.ndarray = shapely.intersects(
+            polygon, [sample.getPoint() for sample in samplesList])
+        return [samplesList[i] for i in np.flatnonzero(intersects)]
 
     @staticmethod
     def mapSamples(
         samples: Collection[Sample]
     ) -> dict[int, tuple[Sample, ...]]:
-        sampleMap: dict[int, set[Sample]] = dict()
+        sampleMap: dict[int, dict[Sample, None]] = dict()
         sample: Sample
         for sample in samples:
             if not sample.getCluster() in sampleMap:
-                sampleMap[sample.getCluster()] = set()
-            sampleMap[sample.getCluster()].add(sample)
+                sampleMap[sample.getCluster()] = dict()
+            sampleMap[sample.getCluster()][sample] = None
+        return {
+            cluster: tuple(sampleDict)
+            for cluster, sampleDict in sampleMap.items()}
+
+    @staticmethod
+    def sampleCoordinates(samples: Collection[Sample]) -> np.ndarray:
+        return shapely.get_coordinates(
+            [sample.getPoint() for sample in samples]).reshape(-1, 2)
+
+    @staticmethod
+    def initSampleArrays(
+        origin: shapely.Point,
+        sampleMap: dict[int, tuple[Sample, ...]]
+    ) -> dict[int, np.ndarray]:
         return {
-            cluster: tuple(sampleSet)
-            for cluster, sampleSet in sampleMap.items()}
+            cluster: np.ascontiguousarray(
+                Perception.sampleCoordinates(samples)
+                - (origin.x, origin.y), dtype=np.float64)
+            for cluster, samples in sampleMap.items()}
     
     @staticmethod
-    def findCluster(point: shapely.Point, samples: Collection[Sample]) -> int:
-        sampleDistances: list[tuple[float, Sample]] = [
-            (point.distance(sample.getPoint()), sample)
-            for sample in samples]
-        sampleDistances.sort(key=lambda x: x[0])
-        return sampleDistances[0][1].getCluster()
+    def findCluster(
+        point: shapely.Point,
+        samples: Sequence[Sample],
+        coords: np.ndarray
+    ) -> int:
+        distances: np.ndarray = np.hypot(
+            coords[:, 0] - point.x, coords[:, 1] - point.y)
+        return samples[int(np.argmin(distances))].getCluster()
     
     @staticmethod
     def initSvd(
-        origin: shapely.Point,
-        sampleMap: dict[int, tuple[Sample, ...]]
+        sampleArrays: dict[int, np.ndarray]
     ) -> dict[int, tuple[np.float64, np.ndarray, float]]:
         clusterSvd: dict[int, tuple[np.float64, np.ndarray, float]] = dict()
         cluster: int
-        samples: tuple[Sample, ...]
-        for cluster, samples in sampleMap.items():
-            points: list[shapely.Point] = [
-                sample.getPoint()
-                for sample in samples]
-            a: list[tuple[float, float]] = [
-                (point.x - origin.x, point.y - origin.y)
-                for point in points]
+        a: np.ndarray
+        for cluster, a in sampleArrays.items():
             U: np.ndarray
             s: np.ndarray
             Vh: np.ndarray
-            U, s, Vh = linalg.svd(a)
-            sVh: list[tuple[np.float64, np.ndarray]] = list(zip(s, Vh))
-            sVh.sort(reverse=True)
-            angle: float = np.atan2(sVh[0][1][1], sVh[0][1][0])
-            clusterSvd[cluster] = (sVh[0][0], sVh[0][1], angle)
+            U, s, Vh = linalg.svd(a, full_matrices=False)
+            # singular values are returned in descending order
+            angle: float = np.atan2(Vh[0][1], Vh[0][0])
+            clusterSvd[cluster] = (s[0], Vh[0], angle)
         return clusterSvd
+
+    @staticmethod
+    def initFingerprint(
+        point: shapely.Point,
+        cluster: int,
+        sampleArrays: dict[int, np.ndarray]
+    ) -> bytes:
+        # content hash independent of sample order
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.array((point.x, point.y, cluster)).tobytes())
+        sampleCluster: int
+        for sampleCluster in sorted(sampleArrays.keys()):
+            points: np.ndarray = sampleArrays[sampleCluster]
+            digest.update(np.int64(sampleCluster).tobytes())
+            digest.update(np.ascontiguousarray(
+                points[np.lexsort((points[:, 1], points[:, 0]))]).tobytes())
+        return digest.digest()
+
+    @staticmethod
+    def padArray(
+        points: np.ndarray,
+        length: int,
+        fill: np.ndarray
+    ) -> np.ndarray:
+        if len(points) >= length:
+            return points
+        return np.concatenate((
+            points,
+            np.broadcast_to(fill, (length - len(points), 2))))
     
     def rotationTo(self, other: Self) -> float:
         selfSampleCounts: dict[int, int] = self.sampleCounts()
@@ -117,122 +174,64 @@ class Perception:
                 if count > maxCount:
                     maxCount = count
                     cluster = currCluster
-        selfVector: np.ndarray = self.svd[cluster][1]
         selfAngle: float = self.svd[cluster][2]
-        otherVector: np.ndarray = other.svd[cluster][1]
         otherAngle: float = other.svd[cluster][2]
         angle: float = selfAngle - otherAngle
         if math.pi < angle <= 1.5 * math.pi:
             angle = angle - math.pi
         elif 1.5 * math.pi < angle:
             angle = angle - 2 * math.pi
-        selfShapelyPoints: list[shapely.Point] = [
-            sample.getPoint()
-            for sample in self.sampleMap[cluster]]
-        selfPoints: list[tuple[float, float]] = [
-            (point.x - self.point.x, point.y - self.point.y)
-            for point in selfShapelyPoints]
-        otherShapelyPoints: list[shapely.Point] = [
-            sample.getPoint()
-            for sample in other.sampleMap[cluster]]
-        otherPoints: list[tuple[float, float]] = [
-            (point.x - other.point.y, point.y - other.point.y)
-            for point in otherShapelyPoints]
-        otherPointsRot1 = [
-            Geometric.rotateTuple(point, (0, 0), angle)
-            for point in otherPoints]
-        otherPointsRot2 = [
-            Geometric.rotateTuple(point, (0, 0), angle + math.pi)
-            for point in otherPoints]
-        distance1: float = stats.wasserstein_distance_nd(
-            selfPoints, otherPointsRot1)
-        distance2: float = stats.wasserstein_distance_nd(
-            selfPoints, otherPointsRot2)
+        selfPoints: np.ndarray = self.sampleArrays[cluster]
+        otherPointsRot: np.ndarray = Geometric.rotateArray(
+            other.sampleArrays[cluster], (0, 0), angle)
+        # rotating by a further pi is a point reflection through the origin
+        distance1: float = self.TRANSPORT.distance(selfPoints, otherPointsRot)
+        distance2: float = self.TRANSPORT.distance(selfPoints, -otherPointsRot)
         if distance2 > distance1:
             angle = angle + math.pi
         return angle
     
     def distanceTo(self, other: Self, rotation: float) -> float:
         totalDistance: float = 0
-        clusters: set[int] = set(self.sampleMap.keys()).union(
-            set(other.sampleMap.keys()))
+        clusters: set[int] = set(self.sampleArrays.keys()).union(
+            set(other.sampleArrays.keys()))
         cluster: int
         for cluster in clusters:
-            selfPoints: list[tuple[float, float]]
-            otherPoints: list[tuple[float, float]]
-            if not (cluster in self.sampleMap and cluster in other.sampleMap):
+            selfPoints: np.ndarray
+            otherPoints: np.ndarray
+            if not (
+                cluster in self.sampleArrays and cluster in other.sampleArrays
+            ):
                 hasCluster: Perception
-                if not cluster in self.sampleMap:
+                if not cluster in self.sampleArrays:
                     hasCluster = other
                 else:
                     hasCluster = self
-                shapelyPoints: list[shapely.Point] = [
-                    sample.getPoint()
-                    for sample in hasCluster.sampleMap[cluster]]
-                points: list[tuple[float, float]] = [
-                    (point.x - hasCluster.point.x, point.y - hasCluster.point.y)
-                    for point in shapelyPoints]
-                shapelyCentroid: shapely.Point = shapely.MultiPoint(
-                    shapelyPoints).centroid
-                centroid: tuple[float, float] = (
-                    shapelyCentroid.x - hasCluster.point.x,
-                    shapelyCentroid.y - hasCluster.point.y
-                )
-                dummyPoints: list[tuple[float, float]] = [
-                    centroid
-                    for i in range(len(points))]
+                points: np.ndarray = hasCluster.sampleArrays[cluster]
                 selfPoints = points
-                otherPoints = dummyPoints
+                otherPoints = np.broadcast_to(
+                    points.mean(axis=0), points.shape)
             else:
-                selfShapelyPoints: list[shapely.Point] = [
-                    sample.getPoint()
-                    for sample in self.sampleMap[cluster]]
-                selfPoints = [
-                    (point.x - self.point.x, point.y - self.point.y)
-                    for point in selfShapelyPoints]
-                otherShapelyPoints: list[shapely.Point] = [
-                    sample.getPoint()
-                    for sample in other.sampleMap[cluster]]
-                otherPoints = [
-                    (point.x - other.point.x, point.y - other.point.y)
-                    for point in otherShapelyPoints]
+                selfPoints = self.sampleArrays[cluster]
+                otherPoints = other.sampleArrays[cluster]
                 if len(selfPoints) < len(otherPoints):
-                    otherShapelyCentroid: shapely.Point = shapely.MultiPoint(
-                        otherShapelyPoints).centroid
-                    otherCentroid: tuple[float, float] = (
-                        otherShapelyCentroid.x - other.point.x,
-                        otherShapelyCentroid.y - other.point.y
-                    )
-                    selfPoints.extend([
-                        otherCentroid
-                        for i in range(len(otherPoints) - len(otherPoints))])
+                    selfPoints = Perception.padArray(
+                        selfPoints, len(otherPoints), otherPoints.mean(axis=0))
                 else:
-                    selfShapelyCentroid: shapely.Point = shapely.MultiPoint(
-                        selfShapelyPoints).centroid
-                    selfCentroid: tuple[float, float] = (
-                        selfShapelyCentroid.x - self.point.x,
-                        selfShapelyCentroid.y - self.point.y
-                    )
-                    otherPoints.extend([
-                        selfCentroid
-                        for i in range(len(selfPoints) - len(selfPoints))])
-            otherPoints = [
-                Geometric.rotateTuple(point, (0, 0), rotation)
-                for point in otherPoints] # type: ignore[misc]
-            distance: float = stats.wasserstein_distance_nd(
-                selfPoints, otherPoints)
+                    otherPoints = Perception.padArray(
+                        otherPoints, len(selfPoints), selfPoints.mean(axis=0))
+            otherPoints = Geometric.rotateArray(otherPoints, (0, 0), rotation)
+            distance: float = self.TRANSPORT.distance(selfPoints, otherPoints)
             totalDistance += distance
         return totalDistance
     
     def samplesInPolygon(self,
         polygon: Union[shapely.Polygon, shapely.MultiPolygon]
     ) -> list[Sample]:
-        samplesWithin: list[Sample] = list()
-        sample: Sample
-        for sample in self.samples:
-            if sample.within(polygon):
-                samplesWithin.append(sample)
-        return samplesWithin
+        shapely.prepare(polygon)
+        within: np.ndarray = np.flatnonzero(shapely.contains_xy(
+            polygon, self.sampleCoords[:, 0], self.sampleCoords[:, 1]))
+        return [self.samples[i] for i in within]
     
     def getId(self) -> str:
         return self.id
@@ -243,13 +242,43 @@ class Perception:
     def getCluster(self) -> int:
         return self.cluster
     
+    def getFingerprint(self) -> bytes:
+        return self.fingerprint
+
     def getRegion(self) -> shapely.Polygon:
         return self.region
     
     def getSamples(self) -> tuple[Sample, ...]:
         return self.samples
 
+    def descriptor(self,
+        clusters: Sequence[int],
+        radius: float,
+        bins: int
+    ) -> np.ndarray:
+        # rotation-invariant summary of per-cluster sample counts, a radial
+        # histogram of sample distances, and per-cluster ratios of the
+        # second to the first singular value
+        counts: np.ndarray = np.zeros(len(clusters))
+        ratios: np.ndarray = np.zeros(len(clusters))
+        i: int
+        cluster: int
+        for i, cluster in enumerate(clusters):
+            if not cluster in self.sampleArrays:
+                continue
+            points: np.ndarray = self.sampleArrays[cluster]
+            counts[i] = len(points)
+            s: np.ndarray = linalg.svdvals(points)
+            if len(s) > 1 and s[0] > 0:
+                ratios[i] = s[1] / s[0]
+        allPoints: np.ndarray = np.concatenate(
+            list(self.sampleArrays.values()))
+        histogram: np.ndarray = np.histogram(
+            np.minimum(np.hypot(allPoints[:, 0], allPoints[:, 1]), radius),
+            bins=bins, range=(0, radius))[0]
+        return np.concatenate((counts, histogram, ratios))
+
     def sampleCounts(self) -> dict[int, int]:
         return {
-            cluster: len(samples)
-            for cluster, samples in self.sampleMap.items()}
\ No newline at end of file
+            cluster: len(points)
+            for cluster, points in self.sampleArrays.items()}
\ No newline at end of file
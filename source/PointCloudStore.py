@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+import shapely
+
+import json
+import os
+from os import path
+from typing import Optional, Self
+
+class PointCloudStore:
+    MANIFEST: str = "manifest.json"
+    VERSION: int = 1
+    DTYPE: np.dtype = np.dtype([
+        ("x", np.float64),
+        ("y", np.float64),
+        ("z", np.float64),
+        ("label", np.int64)
+    ])
+
+    def __init__(self, storeDir: str) -> None:
+        self.storeDir: str = storeDir
+        with open(path.join(storeDir, self.MANIFEST), 'r') as fp:
+            manifest: dict = json.load(fp)
+        if manifest.get("version") != self.VERSION:
+            raise ValueError(
+                f"Point cloud store {storeDir} has version "
+                f"{manifest.get('version')}, expected {self.VERSION}!")
+        # perceptionId to file, number of points and (minx, miny, maxx, maxy)
+        self.perceptions: dict[str, dict] = manifest["perceptions"]
+
+    def __repr__(self) -> str:
+        return f"PointCloudStore: {len(self.perceptions)} @ {self.storeDir}"
+
+    def __contains__(self, perceptionId: str) -> bool:
+        return perceptionId in self.perceptions
+
+    @staticmethod
+    def isStore(storeDir: str) -> bool:
+        return path.isfile(path.join(storeDir, PointCloudStore.MANIFEST))
+
+    @staticmethod
+    def readCsv(csvPath: str) -> np.ndarray:
+        # headerless x, y, z and label rows as a DTYPE array
+        pointCloudDf: pd.DataFrame = pd.read_csv(
+            csvPath,
+            header=None,
+            names=list(PointCloudStore.DTYPE.names),
+            dtype={
+                name: PointCloudStore.DTYPE[name]
+                for name in PointCloudStore.DTYPE.names})
+        pointCloud: np.ndarray = np.empty(
+            len(pointCloudDf), dtype=PointCloudStore.DTYPE)
+        name: str
+        for name in PointCloudStore.DTYPE.names:
+            pointCloud[name] = pointCloudDf[name].to_numpy()
+        return pointCloud
+
+    @staticmethod
+    def tile(
+        pointCloud: np.ndarray,
+        tileSize: float
+    ) -> tuple[np.ndarray, list[list[float]]]:
+        # pointCloud sorted into tileSize squares, each as
+        # [start, end, minx, miny, maxx, maxy] of its rows and their bounds
+        if len(pointCloud) <= 0:
+            return pointCloud, list()
+        if tileSize <= 0:
+            return pointCloud, [
+                [0, len(pointCloud), *PointCloudStore.bounds(pointCloud)]]
+        columns: np.ndarray = np.floor(
+            (pointCloud["x"] - pointCloud["x"].min()) / tileSize
+        ).astype(np.int64)
+        rows: np.ndarray = np.floor(
+            (pointCloud["y"] - pointCloud["y"].min()) / tileSize
+        ).astype(np.int64)
+        order: np.ndarray = np.lexsort((columns, rows))
+        pointCloud = pointCloud[order]
+        tileIds: np.ndarray = rows[order] * (columns.max() + 1) + columns[order]
+        starts: np.ndarray = np.flatnonzero(
+            np.r_[True, tileIds[1:] != tileIds[:-1]])
+        ends: np.ndarray = np.r_[starts[1:], len(pointCloud)]
+        return pointCloud, [
+            [int(start), int(end),
+                *PointCloudStore.bounds(pointCloud[start:end])]
+            for start, end in zip(starts, ends)]
+
+    @staticmethod
+    def bounds(pointCloud: np.ndarray) -> list[float]:
+        return [
+            float(pointCloud["x"].min()),
+            float(pointCloud["y"].min()),
+            float(pointCloud["x"].max()),
+            float(pointCloud["y"].max())
+        ]
+
+    @classmethod
+    def importCsvs(cls,
+        csvDir: str,
+        storeDir: str,
+        tileSize: float = 0
+    ) -> Self:
+        os.makedirs(storeDir, exist_ok=True)
+        perceptions: dict[str, dict] = dict()
+        filename: str
+        for filename in sorted(os.listdir(csvDir)):
+            if not filename.endswith(".csv"):
+                continue
+            perceptionId: str = filename[:-len(".csv")]
+            pointCloud: np.ndarray = cls.readCsv(path.join(csvDir, filename))
+            tiles: list[list[float]]
+            pointCloud, tiles = cls.tile(pointCloud, tileSize)
+            npyName: str = f"{perceptionId}.npy"
+            np.save(path.join(storeDir, npyName), pointCloud)
+            perceptions[perceptionId] = {
+                "file": npyName,
+                "points": len(pointCloud),
+                "bounds": cls.bounds(
+                    pointCloud) if len(pointCloud) > 0 else None,
+                "tiles": tiles
+            }
+            print(
+                f"Imported {len(pointCloud)} points of {perceptionId} "
+                f"in {len(tiles)} tiles")
+        # the manifest is written last, so an interrupted import is not read
+        # as a store
+        tmpManifest: str = path.join(storeDir, f"{cls.MANIFEST}.tmp")
+        with open(tmpManifest, 'w') as fp:
+            json.dump(
+                {"version": cls.VERSION, "perceptions": perceptions}, fp)
+        os.replace(tmpManifest, path.join(storeDir, cls.MANIFEST))
+        return cls(storeDir)
+
+    def read(self, perceptionId: str) -> np.ndarray:
+        # DTYPE array memory-mapped from the store, read only
+        if not perceptionId in self.perceptions:
+            raise KeyError(
+                f"Perception {perceptionId} not in {self.__repr__()}!")
+        return np.load(
+            path.join(self.storeDir, self.perceptions[perceptionId]["file"]),
+            mmap_mode='r')
+
+    def readIntersecting(self,
+        perceptionId: str,
+        geometry: shapely.Geometry
+    ) -> np.ndarray:
+        # rows of tiles whose bounds intersect geometry, in source
+        # coordinates, so only their pages are read
+        pointCloud: np.ndarray = self.read(perceptionId)
+        tiles: Optional[list[list[float]]] = self.perceptions[
+            perceptionId].get("tiles")
+        if tiles is None:
+            return pointCloud
+        if len(tiles) <= 0:
+            return pointCloud[:0]
+        tileArray: np.ndarray = np.array(tiles, dtype=np.float64)
+        intersecting: np.ndarray = shapely.intersects(
+            geometry,
+            shapely.box(
+                tileArray[:, 2], tileArray[:, 3],
+                tileArray[:, 4], tileArray[:, 5]))
+        return np.concatenate(
+            [pointCloud[int(start):int(end)]
+                for start, end in tileArray[intersecting, :2]]
+            + [pointCloud[:0]])
@@ -14,13 +14,14 @@ class Sample:
     
     def __eq__(self, other: object) -> bool:
         if isinstance(other, Sample):
-            return (
-                self.point.equals(other.point)
-                and self.cluster == other.cluster)
+            return self.key() == other.key()
         return False
     
     def __hash__(self):
-        return hash(self.__repr__())
+        return hash(self.key())
+
+    def key(self) -> tuple[float, float, int]:
+        return (self.point.x, self.point.y, self.cluster)
     
     def translate(self,
         originOrVector: object,
@@ -0,0 +1,97 @@
+import numpy as np
+import shapely
+
+from .Geometric import Geometric
+from .Sample import Sample
+
+from typing import Collection, Self, Union
+
+class SampleTable:
+    def __init__(self,
+        x: np.ndarray,
+        y: np.ndarray,
+        cluster: np.ndarray
+    ) -> None:
+        if len(x) != len(y) or len(x) != len(cluster):
+            raise ValueError("Number of x, y, and cluster values must match!")
+        # row i is the sample with id i
+        self.x: np.ndarray = np.asarray(x, dtype=np.float64)
+        self.y: np.ndarray = np.asarray(y, dtype=np.float64)
+        self.cluster: np.ndarray = np.asarray(cluster, dtype=np.int64)
+
+    def __repr__(self) -> str:
+        return f"SampleTable: {len(self)}"
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    @classmethod
+    def fromSamples(cls, samples: Collection[Sample]) -> Self:
+        coords: np.ndarray = shapely.get_coordinates(
+            [sample.getPoint() for sample in samples]).reshape(-1, 2)
+        return cls(
+            coords[:, 0],
+            coords[:, 1],
+            np.array(
+                [sample.getCluster() for sample in samples], dtype=np.int64)
+        )
+
+    def toSamples(self) -> list[Sample]:
+        return [
+            Sample(point, cluster)
+            for point, cluster in zip(
+                self.getPoints().tolist(),
+                self.cluster.tolist())]
+
+    def take(self, ids: np.ndarray) -> Self:
+        return SampleTable(
+            self.x[ids], self.y[ids], self.cluster[ids]
+        ) # type: ignore[return-value]
+
+    def append(self, other: Self) -> Self:
+        return SampleTable(
+            np.concatenate((self.x, other.x)),
+            np.concatenate((self.y, other.y)),
+            np.concatenate((self.cluster, other.cluster))
+        ) # type: ignore[return-value]
+
+    def unique(self) -> tuple[Self, np.ndarray]:
+        # deduplicated table in order of first appearance, and the id in it
+        # of every sample in this table
+        order: np.ndarray = np.lexsort((self.cluster, self.y, self.x))
+        starts: np.ndarray = np.ones(len(self), dtype=np.bool_)
+        starts[1:] = (
+            (self.x[order][1:] != self.x[order][:-1])
+            | (self.y[order][1:] != self.y[order][:-1])
+            | (self.cluster[order][1:] != self.cluster[order][:-1]))
+        groups: np.ndarray = np.cumsum(starts) - 1
+        # lexsort is stable, so each group starts at its first appearance
+        firsts: np.ndarray = order[starts]
+        rank: np.ndarray = np.empty(len(firsts), dtype=np.int64)
+        rank[np.argsort(firsts)] = np.arange(len(firsts))
+        inverse: np.ndarray = np.empty(len(self), dtype=np.int64)
+        inverse[order] = rank[groups]
+        return self.take(np.sort(firsts)), inverse
+
+    def transform(self, matrix: np.ndarray) -> Self:
+        # applies a 2x3 affine matrix to every sample
+        coords: np.ndarray = Geometric.affineArray(
+            np.stack((self.x, self.y), axis=1), matrix)
+        return SampleTable(
+            coords[:, 0], coords[:, 1], self.cluster
+        ) # type: ignore[return-value]
+
+    def translate(self, vector: tuple[float, float]) -> Self:
+        return self.transform(Geometric.translationMatrix(vector))
+
+    def rotate(self, origin: tuple[float, float], rotation: float) -> Self:
+        return self.transform(Geometric.rotationMatrix(origin, rotation))
+
+    def within(self,
+        polygon: Union[shapely.Polygon, shapely.MultiPolygon]
+    ) -> np.ndarray:
+        shapely.prepare(polygon)
+        return shapely.contains_xy(polygon, self.x, self.y)
+
+    def getPoints(self) -> np.ndarray:
+        return shapely.points(self.x, self.y)
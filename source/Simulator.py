@@ -1,4 +1,5 @@
 import geopandas # type: ignore[import-untyped]
+import numpy as np
 import pandas as pd
 import shapely
 from sklearn import cluster # type: ignore[import-untyped]
@@ -9,7 +10,9 @@ from .Collection import Collection
 from .Geometric import Geometric
 from .Perception import Perception
 from .Sample import Sample
+from .SampleTable import SampleTable
 
+import concurrent.futures
 import functools
 import queue
 
@@ -17,6 +20,7 @@ class Simulator:
     MAX_GEN_DIST: float = 40
     MIN_POLYGON_AREA: float = 15
     EPS: float = 10
+    NUM_THREADS: int = 1
 
     def __init__(self,
         queryCollection: Collection,
@@ -25,6 +29,17 @@ class Simulator:
         self.queryCollection: Collection = queryCollection
         self.queryBuildings: Buildings = queryBuildings
 
+    def prepare(self) -> None:
+        # builds the lazy indices of the query collection and buildings,
+        # so that processes forked afterwards share them
+        self.queryCollection.initDescriptorIndex()
+        self.queryCollection.initSampleIndex()
+        self.queryCollection.initPerceptionLookup()
+        self.queryCollection.initRegionAttributes(self.queryBuildings)
+        self.queryBuildings.initIndex()
+        if Buildings.RASTER_RESOLUTION > 0:
+            self.queryBuildings.initRaster()
+
     def run(self,
         site: shapely.Polygon,
         target: Attributes,
@@ -119,7 +134,10 @@ class Simulator:
             Attributes
         ]] = self.findGenerators(polygon, siteCollection, target)
         print(f"{len(generators)} generators")
-        querySamplesAdded: set[Sample] = set()
+        querySamples: list[Sample] = self.queryCollection.getSamples()
+        queryTable: SampleTable = self.queryCollection.getSampleTable()
+        querySamplesAdded: np.ndarray = np.zeros(
+            len(querySamples), dtype=np.bool_)
         newIds: list[str] = list()
         newPoints: list[shapely.Point] = list()
         newRegions: list[shapely.Polygon] = list()
@@ -134,11 +152,26 @@ class Simulator:
         ]] = list()
         leftoverPolygons: list[shapely.Polygon] = list()
         achieved: Attributes = Attributes.of()
+        # generators are disjoint, so their queries are independent and
+        # only the merge below depends on their order
+        queried: list[tuple[
+            Perception,
+            float,
+            list[shapely.Polygon],
+            Attributes,
+            Buildings
+        ]] = self.queryGenerators(generators)
         generator: tuple[Perception, shapely.Polygon, Attributes]
-        for generator in generators:
+        result: tuple[
+            Perception,
+            float,
+            list[shapely.Polygon],
+            Attributes,
+            Buildings
+        ]
+        for generator, result in zip(generators, queried):
             sitePerception: Perception = generator[0]
             generatingPolygon: shapely.Polygon = generator[1]
-            siteTarget: Attributes = generator[2]
             queryPerception: Perception
             rotation: float
             generatedPolygons: list[shapely.Polygon]
@@ -150,12 +183,7 @@ class Simulator:
                 generatedPolygons,
                 queryAchieved,
                 buildings
-            ) = self.queryCollection.query(
-                sitePerception,
-                generatingPolygon,
-                self.queryBuildings,
-                siteTarget
-            )
+            ) = result
             if len(generatedPolygons) <= 0:
                 leftoverPolygons.append(generatingPolygon)
                 continue
@@ -168,43 +196,42 @@ class Simulator:
                     generatingPolygon, shapely.MultiPolygon(generatedPolygons)))
             remainingPolygons = list(
                 filter(lambda p: not p.is_empty, remainingPolygons))
-            clippingPolygons: list[shapely.Polygon] = [
-                Geometric.translateOD( # type: ignore[misc]
-                    Geometric.rotateAboutShapely(
-                        polygon,
-                        destination,
-                        -rotation
-                    ),
-                    destination,
-                    origin
-                )
-                for polygon in generatedPolygons]
-            sampleSetInClip: set[Sample] = set()
-            for polygon in clippingPolygons:
-                samples: list[Sample] = self.queryCollection.samplesInPolygon(
-                    polygon)
-                sampleSetInClip.update(samples)
-            samplesInClip: list[Sample] = list(
-                filter(lambda s: not s in querySamplesAdded, sampleSetInClip))
-            querySamplesAdded.update(samplesInClip)
-            sampleInClip: Sample
-            for sampleInClip in samplesInClip:
-                associatedPerception: Perception = (
-                    self.queryCollection.perceptionFromSample(sampleInClip))
-                newSample = sampleInClip.translate(
-                    origin, destination).rotate(destination, rotation)
-                newId: str = associatedPerception.getId()
-                newPoint: shapely.Point = newSample.getPoint()
-                newRegion: shapely.Polygon = associatedPerception.getRegion()
-                newRegion = Geometric.rotateAboutShapely( # type: ignore[assignment]
-                    Geometric.translateOD(newRegion, origin, destination),
-                    destination,
-                    rotation
+            clippingPolygons: list[shapely.Polygon] = Geometric.affineTransform(
+                generatedPolygons,
+                Geometric.composeMatrices(
+                    Geometric.rotationMatrix(
+                        (destination.x, destination.y), -rotation),
+                    Geometric.translationMatrix(
+                        (origin.x - destination.x, origin.y - destination.y))
                 )
-                newIds.append(newId)
-                newPoints.append(newPoint)
-                newRegions.append(newRegion)
-                newSamples.append(newSample)
+            ).tolist()
+            idsInClip: np.ndarray = np.unique(np.concatenate([
+                self.queryCollection.sampleIdsInPolygon(polygon)
+                for polygon in clippingPolygons]
+                + [np.zeros(0, dtype=np.int64)]))
+            idsInClip = idsInClip[~querySamplesAdded[idsInClip]]
+            querySamplesAdded[idsInClip] = True
+            newSampleTable: SampleTable = queryTable.take(idsInClip).translate(
+                (destination.x - origin.x, destination.y - origin.y)
+            ).rotate((destination.x, destination.y), rotation)
+            associatedPerceptions: list[Perception] = [
+                self.queryCollection.perceptionFromSample(querySamples[i])
+                for i in idsInClip]
+            newIds.extend(
+                perception.getId() for perception in associatedPerceptions)
+            copiedSamples: list[Sample] = newSampleTable.toSamples()
+            newSamples.extend(copiedSamples)
+            newPoints.extend(sample.getPoint() for sample in copiedSamples)
+            newRegions.extend(Geometric.affineTransform(
+                [
+                    perception.getRegion()
+                    for perception in associatedPerceptions],
+                Geometric.composeMatrices(
+                    Geometric.translationMatrix(
+                        (destination.x - origin.x, destination.y - origin.y)),
+                    Geometric.rotationMatrix(
+                        (destination.x, destination.y), rotation))
+            ).tolist())
             generated.append((
                 queryPerception,
                 destination,
@@ -226,6 +253,40 @@ class Simulator:
         newTarget = target.subtract(achieved)
         return (generated, leftoverPolygons, newSiteCollection, newTarget)
     
+    def queryGenerators(self,
+        generators: list[tuple[Perception, shapely.Polygon, Attributes]]
+    ) -> list[tuple[
+        Perception,
+        float,
+        list[shapely.Polygon],
+        Attributes,
+        Buildings
+    ]]:
+        def queryGenerator(
+            generator: tuple[Perception, shapely.Polygon, Attributes]
+        ) -> tuple[
+            Perception,
+            float,
+            list[shapely.Polygon],
+            Attributes,
+            Buildings
+        ]:
+            return self.queryCollection.query(
+                generator[0],
+                generator[1],
+                self.queryBuildings,
+                generator[2]
+            )
+
+        if self.NUM_THREADS <= 1 or len(generators) <= 1:
+            return [queryGenerator(generator) for generator in generators]
+        # lazy indices are built before they are shared between threads
+        self.prepare()
+        with concurrent.futures.ThreadPoolExecutor(
+            min(self.NUM_THREADS, len(generators))
+        ) as executor:
+            return list(executor.map(queryGenerator, generators))
+
     def findGenerators(self,
         polygon: shapely.Polygon,
         siteCollection: Collection,
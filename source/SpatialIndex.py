@@ -0,0 +1,58 @@
+import numpy as np
+import shapely
+
+from typing import Optional, Self, Sequence
+
+class SpatialIndex:
+    def __init__(self,
+        geometries: Sequence[shapely.Geometry] = (),
+        segments: Optional[tuple[tuple[int, shapely.STRtree], ...]] = None
+    ) -> None:
+        # append-only sequence of STRtrees, each with the global index of its
+        # first geometry, kept in decreasing size like a binary counter
+        if segments is None:
+            segments = (
+                ((0, shapely.STRtree(list(geometries))),)
+                if len(geometries) > 0 else tuple())
+        self.segments: tuple[tuple[int, shapely.STRtree], ...] = segments
+        self.size: int = sum(len(tree) for _, tree in segments)
+
+    def __repr__(self) -> str:
+        return f"SpatialIndex: {self.size} in {len(self.segments)} segments"
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, geometries: Sequence[shapely.Geometry]) -> Self:
+        # returns a new index sharing the existing trees, merging only trees
+        # no larger than the appended one
+        if len(geometries) <= 0:
+            return self
+        segments: list[tuple[int, shapely.STRtree]] = list(self.segments)
+        offset: int = self.size
+        newGeometries: np.ndarray = np.asarray(list(geometries), dtype=object)
+        while len(segments) > 0 and len(segments[-1][1]) <= len(newGeometries):
+            offset, tree = segments.pop()
+            newGeometries = np.concatenate((tree.geometries, newGeometries))
+        segments.append((offset, shapely.STRtree(newGeometries)))
+        return SpatialIndex(
+            segments=tuple(segments)) # type: ignore[return-value]
+
+    def geometries(self) -> np.ndarray:
+        if len(self.segments) <= 0:
+            return np.zeros(0, dtype=object)
+        return np.concatenate([tree.geometries for _, tree in self.segments])
+
+    def query(self,
+        geometries: Sequence[shapely.Geometry],
+        predicate: Optional[str] = None
+    ) -> np.ndarray:
+        # (2, n) array of (input index, indexed geometry index) pairs
+        if len(geometries) <= 0 or len(self.segments) <= 0:
+            return np.zeros((2, 0), dtype=np.int64)
+        queried: np.ndarray = np.asarray(list(geometries), dtype=object)
+        pairs: list[np.ndarray] = [
+            tree.query(queried, predicate=predicate)
+            + np.array(((0,), (offset,)))
+            for offset, tree in self.segments]
+        return np.concatenate(pairs, axis=1)
@@ -0,0 +1,149 @@
+import numpy as np
+from scipy import optimize # type: ignore[import-untyped]
+from scipy import spatial # type: ignore[import-untyped]
+from scipy import special # type: ignore[import-untyped]
+from scipy import stats # type: ignore[import-untyped]
+
+import math
+
+class Transport:
+    MODES: tuple[str, ...] = ("exact", "sliced", "sinkhorn")
+    MAX_PROJECTIONS: int = 4096
+    MAX_SINKHORN_ITERATIONS: int = 1000
+
+    def __init__(self, mode: str = "exact", tolerance: float = 1) -> None:
+        if not mode in self.MODES:
+            raise ValueError(
+                f"Transport mode {mode} must be one of {self.MODES}!")
+        if tolerance <= 0:
+            raise ValueError(f"Tolerance {tolerance} must be positive!")
+        self.mode: str = mode
+        self.tolerance: float = tolerance
+
+    def __repr__(self) -> str:
+        return f"Transport: {self.mode} (tolerance {self.tolerance})"
+
+    def distance(self, a: np.ndarray, b: np.ndarray) -> float:
+        return float(self.distances(a[np.newaxis], b[np.newaxis])[0])
+
+    def distances(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        # a: (k, n, 2), b: (k, m, 2) -> (k,)
+        if self.mode == "sliced":
+            return Transport.sliced(a, b, self.tolerance)
+        if self.mode == "sinkhorn":
+            return np.array([
+                Transport.sinkhorn(x, y, self.tolerance)
+                for x, y in zip(a, b)], dtype=np.float64)
+        return np.array([
+            Transport.exact(x, y)
+            for x, y in zip(a, b)], dtype=np.float64)
+
+    @staticmethod
+    def exact(a: np.ndarray, b: np.ndarray) -> float:
+        if len(a) != len(b):
+            return stats.wasserstein_distance_nd(a, b)
+        # with uniform weights on equal-sized sets some optimal plan
+        # is a permutation, so an assignment is an exact solve
+        cost: np.ndarray = spatial.distance.cdist(a, b)
+        rows: np.ndarray
+        cols: np.ndarray
+        rows, cols = optimize.linear_sum_assignment(cost)
+        return float(cost[rows, cols].mean())
+
+    @staticmethod
+    def sliced(a: np.ndarray, b: np.ndarray, tolerance: float) -> np.ndarray:
+        # the 1D distance changes by at most 2 * radius per radian of
+        # direction, which bounds the midpoint rule error over [0, pi)
+        radii: np.ndarray = np.maximum(
+            np.hypot(a[..., 0], a[..., 1]).max(axis=1),
+            np.hypot(b[..., 0], b[..., 1]).max(axis=1))
+        # rounded up to a power of two so that a pair gets the same
+        # directions whichever batch it is evaluated in
+        numProjections: np.ndarray = np.minimum(
+            2 ** np.ceil(np.log2(np.maximum(
+                math.pi ** 2 * radii / (4 * tolerance), 1))).astype(np.int64),
+            Transport.MAX_PROJECTIONS)
+        n: int = a.shape[1]
+        m: int = b.shape[1]
+        # quantile levels of both sets over the common denominator n * m
+        levels: np.ndarray = np.union1d(
+            np.arange(1, n + 1) * m, np.arange(1, m + 1) * n)
+        widths: np.ndarray = np.diff(levels, prepend=0) / (n * m)
+        aIndices: np.ndarray = (levels + m - 1) // m - 1
+        bIndices: np.ndarray = (levels + n - 1) // n - 1
+        distances: np.ndarray = np.zeros(len(a))
+        k: int
+        for k in np.unique(numProjections):
+            batch: np.ndarray = numProjections == k
+            angles: np.ndarray = (np.arange(k) + 0.5) * math.pi / k
+            directions: np.ndarray = np.stack(
+                (np.cos(angles), np.sin(angles)))
+            aSorted: np.ndarray = np.sort(a[batch] @ directions, axis=1)
+            bSorted: np.ndarray = np.sort(b[batch] @ directions, axis=1)
+            projected: np.ndarray = np.einsum(
+                "l,ilk->ik", widths,
+                np.abs(aSorted[:, aIndices] - bSorted[:, bIndices]))
+            # averaging |<x, theta>| over directions scales lengths by 2 / pi
+            distances[batch] = projected.mean(axis=1) * math.pi / 2
+        return distances
+
+    @staticmethod
+    def sinkhorn(a: np.ndarray, b: np.ndarray, tolerance: float) -> float:
+        n: int = len(a)
+        m: int = len(b)
+        cost: np.ndarray = spatial.distance.cdist(a, b)
+        maxCost: float = max(float(cost.max()), 1)
+        # the entropic plan costs at most epsilon * log(n * m) more than
+        # the exact plan, and marginal error at most the largest cost more
+        targetEpsilon: float = tolerance / (2 * max(math.log(n * m), 1))
+        marginalTolerance: float = tolerance / (2 * maxCost)
+        logA: float = -math.log(n)
+        logB: float = -math.log(m)
+        f: np.ndarray = np.zeros(n)
+        g: np.ndarray = np.zeros(m)
+        logPlan: np.ndarray = -cost / targetEpsilon
+        # anneal epsilon from the cost scale down to the target, warm
+        # starting each stage from the previous potentials
+        epsilon: float = max(maxCost, targetEpsilon)
+        iterations: int = 0
+        converged: bool = False
+        while iterations < Transport.MAX_SINKHORN_ITERATIONS:
+            f = epsilon * (logA - special.logsumexp(
+                (g[np.newaxis, :] - cost) / epsilon, axis=1))
+            g = epsilon * (logB - special.logsumexp(
+                (f[:, np.newaxis] - cost) / epsilon, axis=0))
+            iterations += 1
+            if epsilon > targetEpsilon:
+                epsilon = max(epsilon / 2, targetEpsilon)
+                continue
+            logPlan = (f[:, np.newaxis] + g[np.newaxis, :] - cost) / epsilon
+            marginalError: float = float(np.abs(
+                np.exp(special.logsumexp(logPlan, axis=1)) - 1 / n).sum())
+            if marginalError <= marginalTolerance:
+                converged = True
+                break
+        if not converged:
+            # the tolerance no longer bounds the error of the rounded plan
+            print(
+                f"Sinkhorn did not converge in {iterations} iterations, "
+                "falling back to exact transport")
+            return Transport.exact(a, b)
+        return float((Transport.roundPlan(np.exp(logPlan)) * cost).sum())
+
+    @staticmethod
+    def roundPlan(plan: np.ndarray) -> np.ndarray:
+        # project onto plans with uniform marginals (Altschuler et al.) so
+        # that an early-stopped plan still gives an upper bound
+        n: int
+        m: int
+        n, m = plan.shape
+        plan = plan * np.minimum(
+            1 / (n * np.maximum(plan.sum(axis=1), 1e-300)), 1)[:, np.newaxis]
+        plan = plan * np.minimum(
+            1 / (m * np.maximum(plan.sum(axis=0), 1e-300)), 1)[np.newaxis, :]
+        rowError: np.ndarray = 1 / n - plan.sum(axis=1)
+        colError: np.ndarray = 1 / m - plan.sum(axis=0)
+        totalError: float = float(rowError.sum())
+        if totalError > 0:
+            plan = plan + np.outer(rowError, colError) / totalError
+        return plan
@@ -1,8 +1,13 @@
 from .Attributes import Attributes
 from .Buildings import Buildings
+from .Cache import Cache
 from .Collection import Collection
 from .Geometric import Geometric
 from .IO import IO
 from .Perception import Perception
+from .PointCloudStore import PointCloudStore
 from .Sample import Sample
-from .Simulator import Simulator
\ No newline at end of file
+from .SampleTable import SampleTable
+from .Simulator import Simulator
+from .SpatialIndex import SpatialIndex
+from .Transport import Transport
\ No newline at end of file
@@ -0,0 +1,106 @@
+import geopandas
+import numpy as np
+import shapely
+
+from source import Attributes, Buildings
+
+def makeBuildings(
+    polygons: list[shapely.Polygon],
+    heights: list[float]
+) -> Buildings:
+    return Buildings(geopandas.GeoDataFrame(
+        data={
+            "height": heights,
+            "residential_gfa": [polygon.area * 2 for polygon in polygons],
+            "commercial_gfa": [polygon.area for polygon in polygons],
+            "civic_gfa": [0.0 for _ in polygons],
+            "other_gfa": [0.0 for _ in polygons]
+        },
+        geometry=polygons))
+
+def lowerBoundsAndDistances(
+    buildings: Buildings,
+    regionsList: list[list[shapely.Polygon]],
+    target: Attributes
+) -> tuple[np.ndarray, np.ndarray]:
+    bounds: np.ndarray = np.array([
+        target.distanceTo(estimate) - target.distanceError(error)
+        for estimate, error in buildings.approximateMany(regionsList)])
+    distances: np.ndarray = np.array([
+        target.distanceTo(attributes)
+        for attributes, _ in buildings.queryMany(regionsList)])
+    return bounds, distances
+
+def test_tall_building_outside_region(monkeypatch) -> None:
+    monkeypatch.setattr(Buildings, "RASTER_RESOLUTION", 10)
+    # the first building puts the grid origin at (0, 0), so the cell
+    # from 30 to 40 has its centre in the region but holds the tall one
+    buildings: Buildings = makeBuildings(
+        [
+            shapely.box(0, 0, 0.5, 0.5),
+            shapely.box(5, 5, 15, 15),
+            shapely.box(38.5, 12, 39.5, 13)],
+        [1, 10, 1000])
+    regions: list[shapely.Polygon] = [shapely.box(0, 0, 38, 30)]
+    exact: Attributes = buildings.query(regions)[0]
+    assert exact.height == 10
+    assert not buildings.approximateMany([regions])[0][0].height > 10
+    bounds: np.ndarray
+    distances: np.ndarray
+    bounds, distances = lowerBoundsAndDistances(
+        buildings, [regions], exact)
+    assert distances[0] == 0
+    assert not bounds[0] > distances[0] + 1e-9
+
+def test_lower_bound_on_boundaries(monkeypatch) -> None:
+    monkeypatch.setattr(Buildings, "RASTER_RESOLUTION", 10)
+    rng: np.random.Generator = np.random.default_rng(0)
+    corners: np.ndarray = rng.uniform(0, 200, (60, 2))
+    sizes: np.ndarray = rng.uniform(1, 25, (60, 2))
+    buildings: Buildings = makeBuildings(
+        shapely.box(
+            corners[:, 0], corners[:, 1],
+            corners[:, 0] + sizes[:, 0], corners[:, 1] + sizes[:, 1]
+        ).tolist(),
+        rng.uniform(3, 1000, 60).tolist())
+    regionsList: list[list[shapely.Polygon]] = [
+        [shapely.Point(rng.uniform(0, 200, 2)).buffer(
+            rng.uniform(5, 60)).intersection(shapely.box(
+                *rng.uniform(0, 100, 2), *rng.uniform(100, 200, 2)))]
+        for _ in range(100)]
+    regionsList = [
+        regions for regions in regionsList
+        if isinstance(regions[0], shapely.Polygon)
+        and not regions[0].is_empty]
+    target: Attributes
+    for target in (
+        Attributes(0, 0, 0, 0, 0, 0, 0),
+        Attributes(50, 500, 200, 0, 0, 300, 1000),
+        Attributes(1000, 5000, 2000, 0, 0, 3000, 1000)
+    ):
+        bounds: np.ndarray
+        distances: np.ndarray
+        bounds, distances = lowerBoundsAndDistances(
+            buildings, regionsList, target)
+        checked: np.ndarray = ~np.isnan(bounds) & ~np.isnan(distances)
+        assert checked.any()
+        assert np.all(bounds[checked] <= distances[checked] + 1e-6)
+
+def test_invalid_mask_in_batch() -> None:
+    buildings: Buildings = makeBuildings(
+        [shapely.box(2, -1, 4, 11), shapely.box(18, 4, 22, 6)],
+        [10, 20])
+    # a self-intersecting region whose clip raises a TopologyException
+    invalid: shapely.Polygon = shapely.Polygon(
+        [(0, 0), (10, 10), (10, 0), (0, 10)])
+    regionsList: list[list[shapely.Polygon]] = [
+        [invalid], [shapely.box(15, 0, 20, 10)], [shapely.box(0, 0, 3, 10)]]
+    batched: list[tuple[Attributes, Buildings]] = buildings.queryMany(
+        regionsList)
+    regions: list[shapely.Polygon]
+    attributes: Attributes
+    for regions, (attributes, _) in zip(regionsList, batched):
+        alone: Attributes = buildings.queryMany([regions])[0][0]
+        assert attributes.__dict__ == alone.__dict__
+    assert batched[1][0].footprintArea == 4
+    assert batched[2][0].footprintArea == 10
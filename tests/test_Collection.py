@@ -0,0 +1,99 @@
+import geopandas
+import numpy as np
+import shapely
+
+from source import Attributes, Buildings, Collection, Perception, Sample
+
+def makePerceptions(
+    rng: np.random.Generator,
+    samples: list[Sample],
+    count: int
+) -> list[Perception]:
+    points: np.ndarray = rng.uniform(50, 350, (count, 2))
+    return [
+        Perception(
+            f"p{i}",
+            shapely.Point(x, y),
+            shapely.Point(x, y).buffer(Collection.PERCEPTION_RADIUS / 2),
+            samples)
+        for i, (x, y) in enumerate(points)]
+
+def test_query_independent_of_threads(monkeypatch) -> None:
+    monkeypatch.setattr(Collection, "NUM_CONSIDERED_PERCEPTIONS", 5)
+    rng: np.random.Generator = np.random.default_rng(0)
+    samples: list[Sample] = [
+        Sample(shapely.Point(x, y), int(cluster))
+        for (x, y), cluster in zip(
+            rng.uniform(0, 400, (400, 2)), rng.integers(0, 4, 400))]
+    perceptions: list[Perception] = makePerceptions(rng, samples, 40)
+    corners: np.ndarray = rng.uniform(0, 400, (80, 2))
+    sizes: np.ndarray = rng.uniform(5, 30, (80, 2))
+    polygons: list[shapely.Polygon] = shapely.box(
+        corners[:, 0], corners[:, 1],
+        corners[:, 0] + sizes[:, 0], corners[:, 1] + sizes[:, 1]).tolist()
+    queryBuildings: Buildings = Buildings(geopandas.GeoDataFrame(
+        data={
+            "height": rng.uniform(3, 100, 80),
+            "residential_gfa": [polygon.area * 2 for polygon in polygons],
+            "commercial_gfa": [polygon.area for polygon in polygons],
+            "civic_gfa": [0.0 for _ in polygons],
+            "other_gfa": [0.0 for _ in polygons]
+        },
+        geometry=polygons))
+    query: Perception = makePerceptions(rng, samples, 1)[0]
+    queryPolygon: shapely.Polygon = shapely.box(0, 0, 400, 400)
+    target: Attributes = Attributes(50, 20000, 10000, 0, 0, 5000, 40000)
+    results: list[tuple] = list()
+    numThreads: int
+    for numThreads in (1, 4):
+        monkeypatch.setattr(Collection, "NUM_THREADS", numThreads)
+        perception: Perception
+        rotation: float
+        regions: list[shapely.Polygon]
+        attributes: Attributes
+        perception, rotation, regions, attributes, _ = Collection(
+            perceptions).query(query, queryPolygon, queryBuildings, target)
+        results.append((
+            perception.getId(),
+            rotation,
+            [region.wkb for region in regions],
+            attributes.__dict__))
+    assert results[0] == results[1]
+
+def test_samples_in_polygon_of_perceptions() -> None:
+    rng: np.random.Generator = np.random.default_rng(0)
+    samples: list[Sample] = [
+        Sample(shapely.Point(x, y), int(cluster))
+        for (x, y), cluster in zip(
+            rng.uniform(0, 400, (400, 2)), rng.integers(0, 4, 400))]
+    collection: Collection = Collection(
+        makePerceptions(rng, samples, 10))
+    polygon: shapely.Polygon = shapely.box(100, 100, 300, 300)
+    found: list[Sample] = collection.samplesInPolygon(polygon)
+    assert len(found) > 0
+    assert all(polygon.contains(sample.getPoint()) for sample in found)
+    assert set(found) == {
+        sample
+        for sample in collection.getSamples()
+        if polygon.contains(sample.getPoint())}
+
+def test_invalid_regions_never_pruned(monkeypatch) -> None:
+    monkeypatch.setattr(Buildings, "RASTER_RESOLUTION", 2)
+    polygons: list[shapely.Polygon] = [
+        shapely.box(0, 0, 10, 10), shapely.box(20, 0, 30, 10)]
+    queryBuildings: Buildings = Buildings(geopandas.GeoDataFrame(
+        data={
+            "height": [10, 20],
+            "residential_gfa": [polygon.area for polygon in polygons],
+            "commercial_gfa": [0.0 for _ in polygons],
+            "civic_gfa": [0.0 for _ in polygons],
+            "other_gfa": [0.0 for _ in polygons]
+        },
+        geometry=polygons))
+    candidateQueryRegions: list[list[shapely.Polygon]] = [
+        [shapely.box(0, 0, 30, 10)],
+        [shapely.Polygon([(0, 0), (30, 10), (30, 0), (0, 10)])]]
+    target: Attributes = Attributes(50, 1000, 0, 0, 0, 500, 300)
+    # every valid candidate is worse than a threshold below any distance
+    assert Collection(list()).rankApproximately(
+        [0, 1], candidateQueryRegions, queryBuildings, target, -1) == [1]